@@ -24,19 +24,27 @@ mpl.use('Agg')
 import matplotlib.pyplot as plt
 
 
-def repeat_cluster_scoring(gold_standard, clusters, max_clique, n_repeat=50):
+def repeat_cluster_scoring(gold_standard, clusters, max_clique, n_repeat=50, executor=None):
     """
     since complex comparison script is based on random selection, the analysis is repeated
     for a given n number of times to return mean and stdev of the grand f1 score
+        executor: object with a starmap method, e.g. a pyseus executors.Executor,
+            to run the repeats with. Defaults to a multiprocessing pool
     """
 
     multi_args = zip(repeat(gold_standard, times=n_repeat), repeat(clusters), repeat(max_clique))
 
     # multiprocessing
-    p = Pool()
-    grand_f1s = p.starmap(grand_f1_score, multi_args)
-    p.close()
-    p.join()
+    if executor is not None:
+        grand_f1s = executor.starmap(grand_f1_score, multi_args)
+    else:
+        p = Pool()
+        try:
+            grand_f1s = p.starmap(grand_f1_score, multi_args)
+            p.close()
+        finally:
+            p.terminate()
+            p.join()
 
     mean, std = np.mean(grand_f1s), np.std(grand_f1s)
 
@@ -11,18 +11,29 @@ def retrieve_cluster_df(network, cluster, target_col='target', prey_col='prey'):
     """
     From a  list of cluster members from clusterone results, retrieve
     corresponding cluster from the network
+        network: DataFrame, or an interaction store with an edges_within method,
+            e.g. a pyseus InteractionStore, that finds the edges from its indexes
     """
+    if hasattr(network, 'edges_within'):
+        return network.edges_within(cluster, self_edges=False)
 
     network = network.copy()
     network = network[network[target_col] != network[prey_col]]
     return network[(network[target_col].isin(cluster)) & (network[prey_col].isin(cluster))]
 
 
-def mcl_haircut(first_mcl, all_hits, target_col, prey_col, edge='', edge_thresh=0, clean=True):
+def mcl_haircut(first_mcl, all_hits, target_col, prey_col, edge='', edge_thresh=0, clean=True,
+    executor=None):
     """
     Haircut clusterone members (removing single edge interactors)
+        all_hits: DataFrame, or an interaction store with an edges_within method,
+            e.g. a pyseus InteractionStore, sent to the workers as its directory
+            once saved
+        executor: object with a starmap method, e.g. a pyseus executors.Executor,
+            to run the haircuts with. Defaults to a multiprocessing pool
     """
-    all_hits = all_hits.copy()
+    if isinstance(all_hits, pd.DataFrame):
+        all_hits = all_hits.copy()
     first_mcl = first_mcl.copy()
     members = first_mcl['gene_name']
 
@@ -36,10 +47,16 @@ def mcl_haircut(first_mcl, all_hits, target_col, prey_col, edge='', edge_thresh=
     )
 
     # multi processing for recursive haircut
-    p = Pool()
-    haircuts = p.starmap(recursive_haircut, multi_args)
-    p.close()
-    p.join()
+    if executor is not None:
+        haircuts = executor.starmap(recursive_haircut, multi_args)
+    else:
+        p = Pool()
+        try:
+            haircuts = p.starmap(recursive_haircut, multi_args)
+            p.close()
+        finally:
+            p.terminate()
+            p.join()
 
     first_mcl['haircut_members'] = haircuts
 
@@ -81,9 +98,12 @@ def haircut(cluster, all_hits, target_col, prey_col, edge, edge_thresh):
     """
 
     # Find all edges that belong to a given cluster
-    cluster_group = all_hits[
-        (all_hits[target_col].isin(cluster)) & (all_hits[prey_col].isin(cluster))
-    ]
+    if hasattr(all_hits, 'edges_within'):
+        cluster_group = all_hits.edges_within(cluster)
+    else:
+        cluster_group = all_hits[
+            (all_hits[target_col].isin(cluster)) & (all_hits[prey_col].isin(cluster))
+        ]
 
     haircut_members = []
     for member in cluster:
@@ -152,7 +172,8 @@ def second_mcl(
     Performs secondary clustering from the first MCL cluster results. 
     Require network df that contains PPI edges and the cleaned first_mcl results
     """
-    network = network.copy()
+    if isinstance(network, pd.DataFrame):
+        network = network.copy()
     first_mcl = first_mcl.copy()
     clusters = first_mcl['gene_names']
 
@@ -229,7 +250,8 @@ def split_mcl(
     """
     If MCL cluster has two core clusters, try to split it into two
     """
-    network = network.copy()
+    if isinstance(network, pd.DataFrame):
+        network = network.copy()
     summary = summary.copy()
 
     clusters = summary.groupby('super_cluster')['gene_name'].apply(list).to_list()
@@ -8,15 +8,23 @@ def calculate_intercluster_edges(cluster_membership, interactions):
     requires edge weights between clusters. 
     For this, we simply calculate existing # of interactions amongst members
     of two clusters.
+        interactions: DataFrame with prot_1 and prot_2 columns, or an interaction
+            store with an edges_between method, e.g. a pyseus InteractionStore
+            built with prot_1 and prot_2 as its target and prey columns
     """
 
-    interactions = interactions.copy()
+    if isinstance(interactions, pd.DataFrame):
+        interactions = interactions.copy()
     
     cluster_membership = cluster_membership.copy()
 
     # All the unique clusters in the PPI network, designated by Markov clustering
     clusters = cluster_membership['community'].unique()
 
+    # Find all genes in membership of each cluster once
+    cluster_genes = {clust: cluster_membership[cluster_membership['community'] == clust][
+        'gene_names'].to_list() for clust in clusters}
+
     # Returned dataframe will have three columns - origin cluster, target cluster,
     # and sum of interactions between the two clusters
     clust_ones = []
@@ -34,25 +42,12 @@ def calculate_intercluster_edges(cluster_membership, interactions):
             clust_ones.append(clust_one)
             clust_twos.append(clust_two)
 
-            # Find all genes in membership
-            clust_one_genes = cluster_membership[
-                cluster_membership['community'] == clust_one
-            ]['gene_names'].to_list()
-
-            clust_two_genes = cluster_membership[
-                cluster_membership['community'] == clust_two
-            ]['gene_names'].to_list()
+            clust_one_genes = cluster_genes[clust_one]
+            clust_two_genes = cluster_genes[clust_two]
 
             # Find all interactions between two clusters and sum the # interactions
-            inter_1 = interactions[
-                (interactions['prot_1'].isin(clust_one_genes)) &
-                (interactions['prot_2'].isin(clust_two_genes))
-            ].drop_duplicates()
-
-            inter_2 = interactions[
-                (interactions['prot_1'].isin(clust_two_genes)) & 
-                (interactions['prot_2'].isin(clust_one_genes))
-            ].drop_duplicates()
+            inter_1 = interactions_between(interactions, clust_one_genes, clust_two_genes)
+            inter_2 = interactions_between(interactions, clust_two_genes, clust_one_genes)
 
             total = inter_1.shape[0] + inter_2.shape[0]
 
@@ -67,6 +62,20 @@ def calculate_intercluster_edges(cluster_membership, interactions):
     return cluster_edges
 
 
+def interactions_between(interactions, genes_1, genes_2):
+    """
+    Unique interactions from the genes of one cluster (prot_1) to the genes
+    of another (prot_2)
+    """
+    if hasattr(interactions, 'edges_between'):
+        return interactions.edges_between(genes_1, genes_2).drop_duplicates()
+
+    return interactions[
+        (interactions['prot_1'].isin(genes_1)) &
+        (interactions['prot_2'].isin(genes_2))
+    ].drop_duplicates()
+
+
 def query_panther(target_names, all_target_names, biological):
     """
     from a list of genes out of database of genes, calculate GO enrichment and FDR
@@ -1,22 +1,27 @@
+import numbers
 import pandas as pd
 import numpy as np
 
-from itertools import repeat
-from multiprocessing import Pool
 from pyseus import validation_analysis as vali
 
 
-def precision_recall_curve(all_hits, target_col, prey_col, corum, helas, thresholds, metric=None):
+def precision_recall_curve(all_hits, target_col, prey_col, corum, helas, thresholds, metric=None,
+    curvature=3):
     """
     calculates colocalization precision and corum coverage recall to create precision-recall
-    curve data by sliding across interaction calling thresholds
+    curve data by sliding across interaction calling thresholds. Each interaction is given the
+    critical threshold below which it is called, and the whole curve is computed from one
+    sort of the critical thresholds instead of re-calling interactions for every threshold.
 
         all_hits – DataFrame, output of get_all_interactors or drop_unchosen, just_hits=False
         corum – DataFrame, CORUM complex dataframe
         helas – DataFrame, protein group localization data from fractions MS, despite the naming,
         it can either be HELA or HEK dataset
-        thresholds – list, a list of floats that serve as thresholds for interaction calling
-        custom – boolean, whether to use simple p-value thresholding or FDR curve thresholding
+        thresholds – list, a list of floats that serve as thresholds for interaction calling,
+            or an int, the number of thresholds to spread over the quantiles of the
+            critical thresholds of all interactions
+        metric – str, column for simple thresholding, otherwise FDR curve thresholding
+            with the given curvature and the thresholds as offsets
 
     """
 
@@ -25,37 +30,166 @@ def precision_recall_curve(all_hits, target_col, prey_col, corum, helas, thresho
         all_hits = all_hits[[target_col, prey_col, metric]].copy()
     else:
         all_hits = all_hits[[target_col, prey_col , 'pvals', 'enrichment']].copy()
-    all_hits['target'] = all_hits['target'].astype(str)
-    all_hits['prey'] = all_hits['prey'].astype(str)
+    # force string type, as categoricals of one gene dictionary shared by all counts
+    genes, codes = vali.shared_gene_codes(all_hits[target_col], all_hits[prey_col])
+    all_hits[target_col] = pd.Categorical.from_codes(codes[0], categories=genes)
+    all_hits[prey_col] = pd.Categorical.from_codes(codes[1], categories=genes)
+
+    crit = critical_thresholds(all_hits, metric, curvature)
 
-    recalls = []
-    precisions = []
-    
     # For recall-precisions, set default threshold if threshold is not defined
-    if not thresholds:
+    if isinstance(thresholds, numbers.Integral):
+        finite = crit[np.isfinite(crit)]
+        thresholds = np.unique(np.quantile(finite, np.linspace(0, 1, thresholds)))
+    elif thresholds is None or len(thresholds) == 0:
         if metric:
             thresholds = [1, 2, 3, 4.5, 6, 9, 12, 15, 20, 25, 30]
         else:
             thresholds = [0, 1, 2, 3, 4, 5, 6, 7]
+    thresholds = np.asarray(thresholds, dtype=float)
 
-    multi_args = zip(repeat(all_hits), repeat(corum), repeat(helas), repeat(metric), thresholds)
-
-    # multi processing
-    p = Pool()
-    precision_recalls = p.starmap(precision_recall, multi_args)
+    # only interactions that are called at some threshold matter
+    called = crit > -np.inf
+    all_hits = all_hits[called]
+    crit = crit[called]
 
-    p.close()
-    p.join()
+    overlap, coverage = recall_counts(all_hits[target_col], all_hits[prey_col], crit,
+        corum, thresholds)
+    colocalized, pairs = precision_counts(all_hits[target_col], all_hits[prey_col], crit,
+        helas, thresholds)
 
-    unzip_prs = list(zip(*precision_recalls))
-    precisions, recalls = unzip_prs[0], unzip_prs[1]
-    pr_table = pd.DataFrame()
-    pr_table['precision'] = precisions
-    pr_table['recall'] = recalls
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pr_table = pd.DataFrame()
+        pr_table['threshold'] = thresholds
+        pr_table['precision'] = colocalized / pairs
+        pr_table['recall'] = coverage / overlap
 
     return pr_table
 
 
+def critical_thresholds(all_hits, metric=None, curvature=3):
+    """
+    Threshold below which each interaction is called, -inf if it is never called.
+    With a metric, interactions are called when metric > threshold. Otherwise they are
+    called when pvals are above the FDR curve with the curvature and the threshold as
+    offset, as in Validation.static_fdr.
+
+    rtype: np.array
+    """
+    if metric:
+        crit = all_hits[metric].to_numpy(dtype=float)
+        return np.where(np.isnan(crit), -np.inf, crit)
+
+    enrichment = all_hits['enrichment'].to_numpy(dtype=float)
+    pvals = all_hits['pvals'].to_numpy(dtype=float)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        crit = enrichment - curvature / pvals
+        # negative enrichments can only be called by negative offsets at most equal to them
+        crit = np.where(enrichment < 0,
+            np.minimum(enrichment, -enrichment - curvature / pvals), crit)
+
+    return np.where((pvals > 0) & ~np.isnan(crit), crit, -np.inf)
+
+
+def count_above(crit, thresholds):
+    """
+    Count # of critical thresholds above each threshold
+    """
+    crit = np.sort(crit)
+    return len(crit) - np.searchsorted(crit, thresholds, side='right')
+
+
+def recall_counts(targets, preys, crit, corum, thresholds):
+    """
+    CORUM interactions with a target in the called network, and CORUM interactions
+    covered by the called network, at each threshold. Follows the non-directional
+    Validation.corum_interaction_coverage: an interaction enters the overlap when
+    either protein becomes a target and is covered once found in either direction,
+    self-interactions counting twice.
+
+    rtype: overlap np.array, coverage np.array
+    """
+    genes, (target_codes, prey_codes) = vali.shared_gene_codes(targets, preys)
+    n_genes = len(genes)
+    crit = np.asarray(crit, dtype=float)
+
+    # highest critical threshold of each target, and of each target-prey edge
+    target_crit = np.full(n_genes + 1, -np.inf)
+    np.maximum.at(target_crit, target_codes, crit)
+    edge_crit = pd.Series(crit).groupby(vali.pair_keys(target_codes, prey_codes,
+        n_genes)).max()
+    edge_crit = edge_crit[edge_crit.index >= 0]
+
+    prot_1 = corum['prot_1']
+    prot_2 = corum['prot_2']
+    corum_1 = genes.get_indexer(prot_1)
+    corum_2 = genes.get_indexer(prot_2)
+
+    # an interaction is in the overlap as soon as either of its proteins is a target,
+    # genes missing from the dictionary (-1) look up the last, never called, slot
+    target_crit[-1] = -np.inf
+    overlap_crit = np.fmax(target_crit[corum_1], target_crit[corum_2])
+
+    forward = edge_crit.reindex(vali.pair_keys(corum_1, corum_2, n_genes)).to_numpy()
+    reverse = edge_crit.reindex(vali.pair_keys(corum_2, corum_1, n_genes)).to_numpy()
+
+    self_interaction = (prot_1 == prot_2).to_numpy()
+    coverage_crit = np.concatenate([np.fmax(forward, reverse), forward[self_interaction]])
+
+    # interactions that are never called have nan criticals, which are never counted
+    overlap = count_above(overlap_crit, thresholds)
+    coverage = count_above(np.nan_to_num(coverage_crit, nan=-np.inf), thresholds)
+
+    return overlap, coverage
+
+
+def precision_counts(targets, preys, crit, helas, thresholds):
+    """
+    Colocalized and total merged localization pairs of the unique called interactions
+    at each threshold, following Validation.colocalization_precision: interactions are
+    made directionless, self-interactions are left out, and a gene with several
+    localization rows is counted once per row.
+
+    rtype: colocalized np.array, pairs np.array
+    """
+    genes, (target_codes, prey_codes) = vali.shared_gene_codes(targets, preys)
+
+    # directionless pairs of gene codes, sorted as the gene names are
+    swap = prey_codes < target_codes
+    first = np.where(swap, prey_codes, target_codes)
+    second = np.where(swap, target_codes, prey_codes)
+    keep = (first != second) & (first >= 0)
+    pair_crit = pd.Series(np.asarray(crit, dtype=float)[keep]).groupby(
+        vali.pair_keys(first[keep], second[keep], len(genes))).max()
+
+    pairs = pd.DataFrame({
+        'prot_1': pair_crit.index.to_numpy() // len(genes),
+        'prot_2': pair_crit.index.to_numpy() % len(genes),
+        'crit': pair_crit.to_numpy()})
+
+    localization, wildcard = vali.localization_bitmasks(helas)
+    localization = pd.DataFrame({
+        'gene_names': genes.get_indexer(localization['gene_names']),
+        'mnc_classifier': localization['mnc_classifier'].to_numpy()})
+    localization = localization[localization['gene_names'] >= 0]
+
+    merged = pairs.merge(localization.rename(
+        columns={'gene_names': 'prot_1', 'mnc_classifier': 'target_localization'}),
+        on='prot_1', how='inner')
+    merged = merged.merge(localization.rename(
+        columns={'gene_names': 'prot_2', 'mnc_classifier': 'prey_localization'}),
+        on='prot_2', how='inner')
+
+    target = merged['target_localization'].to_numpy()
+    prey = merged['prey_localization'].to_numpy()
+    colocalized = ((target & prey) != 0) | (((target | prey) & wildcard) != 0)
+
+    merged_crit = merged['crit'].to_numpy(dtype=float)
+    return count_above(merged_crit[colocalized], thresholds), count_above(merged_crit,
+        thresholds)
+
+
 def precision_recall(all_hits, corum, helas, metric, threshold, interaction_called=False):
     """
     function for calulating precision recall in single threshold, used for parallel processing
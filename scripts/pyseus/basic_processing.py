@@ -5,10 +5,18 @@ import multiprocessing
 import os
 import re
 import pickle
+import zlib
+import hashlib
+import collections
 import pandas as pd
 import numpy as np
-from itertools import repeat
-from multiprocessing import Pool
+from pyseus import stage_store
+from pyseus import profiling
+from pyseus import replicate_tensor
+
+
+# named intensity transformations of transform_intensities
+TRANSFORMS = {'log2': np.log2, 'log10': np.log10, 'log': np.log, 'asinh': np.arcsinh}
 
 
 class RawTables:
@@ -19,10 +27,16 @@ class RawTables:
     """
     
     # initiate raw table by importing from data directory
-    def __init__(self, root, analysis, intensity_type, pg_file='proteinGroups.txt'):
+    def __init__(self, root, analysis, intensity_type, pg_file='proteinGroups.txt',
+        streaming=False, chunksize=100000):
         
-        self.raw_table = pd.read_csv(root+pg_file,
-            sep='\t', header=0, low_memory=False)
+        if streaming:
+            # only read the columns and rows that filter_table keeps
+            self.raw_table = read_protein_groups(root+pg_file, intensity_type,
+                chunksize=chunksize)
+        else:
+            self.raw_table = pd.read_csv(root+pg_file,
+                sep='\t', header=0, low_memory=False)
         
         # root directory
         self.root = root
@@ -30,26 +44,43 @@ class RawTables:
         self.analysis = analysis
         # Specification of which intensity (raw or LFQ) to use
         self.intensity_type = intensity_type
+        # timing and memory records of the processing stages
+        self.profiler = profiling.StageProfiler()
     
 
-    def save(self, option_str=''):
+    def __getattr__(self, name):
+        # tables of a columnar save are only read when first accessed
+        return stage_store.lazy_stage(self, name)
+
+    def __getstate__(self):
+        # a pickle of an object opened from a columnar save holds all of its tables
+        return stage_store.pickle_state(self)
+
+    def save(self, option_str='', columnar=False):
         """
-        save class to a designated directory
+        save class to a designated directory. With columnar, every table is saved
+        as a separate stage of a StageStore directory instead of a single pickle
         """
         analysis_dir = self.root + self.analysis
         if len(option_str) > 0:
             option_str = '_' + option_str
-        file_dir = analysis_dir + "/preprocessed_tables" + option_str + '.pkl' 
+        file_dir = analysis_dir + "/preprocessed_tables" + option_str
+        if not columnar:
+            file_dir += '.pkl'
         if not os.path.isdir(analysis_dir):
             print(analysis_dir)
             print('Directory does not exist! Creating new directory')
             os.mkdir(analysis_dir)
 
         print("Saving to: " + file_dir)
-        with open(file_dir, 'wb') as file_:
-            pickle.dump(self, file_, -1)
+        if columnar:
+            stage_store.save_object(self, file_dir)
+        else:
+            with open(file_dir, 'wb') as file_:
+                pickle.dump(self, file_, -1)
 
       
+    @profiling.profile_stage(['raw_table'], ['filtered_table'])
     def filter_table(self, verbose=True):
         """filter rows that do not meet the QC (contaminants, reverse seq, only identified by site)
         Also filter non-intensity columns that will not be used for further processing"""
@@ -84,43 +115,56 @@ class RawTables:
 
         self.filtered_table = ms_table
     
-    def transform_intensities(self, func=np.log2):
-        """transform intensity values in the dataframe to a given function"""
-        
+    @profiling.profile_stage(['filtered_table'], ['transformed_table'])
+    def transform_intensities(self, func=np.log2, dtype=np.float32, inplace=False):
+        """
+        transform intensity values in the dataframe to a given function,
+        as a single array operation on the whole intensity block.
+        Zero intensities (-inf after a log transform) are converted to nans.
+            func: numpy ufunc or str, 'log2', 'log10', 'log' or 'asinh'. Other
+                callables are applied to the whole block, or cell by cell if they
+                do not accept arrays
+            dtype: numpy dtype of the transformed intensities
+            inplace: boolean, transform the intensities of filtered_table
+                instead of a copy, filtered_table becomes the transformed_table
+        """
+
         try:
-            filtered = self.filtered_table.copy()
+            filtered = self.filtered_table
         except AttributeError:
             print(
                 "Raw table has not been filtered yet, use filter_table() method"\
                 "before transforming intensities")
             return
 
-        filtered = self.filtered_table.copy()
-        intensity_cols = select_intensity_cols(list(self.filtered_table),
+        if isinstance(func, str):
+            func = TRANSFORMS[func]
+
+        intensity_cols = select_intensity_cols(list(filtered),
             intensity_type=self.intensity_type)
 
-        # for each intensity column, transform the values
-        for int_col in intensity_cols:
-            # if transformation is log2, convert 0s to nans
-            # (faster in one apply step than 2)
-            if func == np.log2:
-                filtered[int_col] = filtered[int_col].apply(lambda x: np.nan
-                    if x == 0 else func(x))
-            else:
-                filtered[int_col] = filtered[int_col].apply(func)
-                # Replace neg inf values is np.nan
-                filtered[int_col] = filtered[int_col].apply(
-                    lambda x: np.nan if np.isneginf(x) else x)
-        
-        self.transformed_table = filtered
+        values = filtered[intensity_cols].to_numpy(dtype=dtype)
+        values = transform_values(values, func, dtype)
+
+        if inplace:
+            filtered[intensity_cols] = values
+            self.transformed_table = filtered
+            return
+
+        block = pd.DataFrame(values, index=filtered.index, columns=intensity_cols,
+            copy=False)
+        info = filtered.drop(columns=intensity_cols)
+        transformed = pd.concat([info, block], axis=1)
+
+        self.transformed_table = transformed[list(filtered)]
     
+    @profiling.profile_stage(['transformed_table'], ['grouped_table'])
     def group_replicates(self, intensity_re=r'_\d+$', reg_exp=r'(.*_.*)_\d+$'):
         """Group the replicates of intensities into replicate groups"""
         
         reg_exp = self.intensity_type + ' ' + reg_exp
         try: 
-            self.transformed_table
-            transformed = self.transformed_table.copy()
+            transformed = self.transformed_table
         except AttributeError:
             print(
             'Intensity values have not been transformed yet from '\
@@ -128,82 +172,55 @@ class RawTables:
             'method before grouping replicates.\n')
 
             try: 
-                self.filtered_table
+                transformed = self.filtered_table
                 print("Using filtered_table to group replicates.")
-                transformed = self.filtered_table.copy()
             except AttributeError:
                 print('Please filter raw table first using filter_table()\
                     method.')
                 return
 
 
-       # get col names
-        col_names = list(transformed)
+        # group col names into replicate groups, with 'Info' for non-intensity cols
+        group_names = replicate_group_names(list(transformed), intensity_re, reg_exp)
 
-        # using a dictionary, group col names into replicate groups
-        group_dict = {}
-        for col in col_names:
-            # search REs of the replicate ID, and get the group names
-
-            # search if the col is for intensity values
-            intensity_search = re.search(intensity_re, col.lower(),
-                flags=re.IGNORECASE)
-
-            # if so, get the group name and add to the group dict
-            # use groups from re.search to customize group names
-            if intensity_search:
-                group_search = re.search(reg_exp, col, flags=re.IGNORECASE)
-                group_name = ''
-
-                for re_group in group_search.groups():
-                    group_name += re_group
-                group_dict[col] = group_name
-
-            # if not, group into 'Info'
-            else:
-                group_dict[col] = 'Info'
-
-
-        # pd function to add the replicate group to the columns
-        grouped = pd.concat(dict((*transformed.groupby(group_dict, 1),)), axis=1)
+        # order the columns by group, keeping the column order within groups,
+        # and relabel them without copying if they are already in order
+        order = sorted(range(len(group_names)), key=group_names.__getitem__)
+        if order == list(range(len(group_names))):
+            grouped = transformed.copy(deep=False)
+        else:
+            grouped = transformed.iloc[:, order]
 
-        grouped.columns = grouped.columns.rename("Baits", level=0)
-        grouped.columns = grouped.columns.rename("Replicates", level=1) 
+        grouped.columns = pd.MultiIndex.from_arrays(
+            [[group_names[i] for i in order], [transformed.columns[i] for i in order]],
+            names=['Baits', 'Replicates'])
 
         self.grouped_table = grouped
     
     
-    def remove_invalid_rows(self):
+    @profiling.profile_stage(['grouped_table'], ['preimpute_table'])
+    def remove_invalid_rows(self, min_replicates=None):
         """Remove rows that do not have at least one group that has values
-        in all triplicates"""
+        in all its replicates, or in at least min_replicates of them
+            min_replicates: int, minimum number of valid replicates of a group,
+                defaults to all the replicates of the group
+        """
 
         try:
-            grouped = self.grouped_table.reset_index(drop=True).copy()
+            grouped = self.grouped_table
         except AttributeError:
             print("Replicates need to be grouped before this method."\
                 "Please use group_replicates() to group replicates under same sample")
             return
 
-        # reset index
-        grouped = self.grouped_table.reset_index(drop=True).copy()
-        unfiltered = self.grouped_table.shape[0]
+        unfiltered = grouped.shape[0]
 
-        # Get a list of all groups in the df
-        group_list = list(set([col[0] for col in list(grouped) if col[0] != 'Info']))
-
-        # booleans for if there is a valid value
-        filtered = grouped[group_list].apply(np.isnan)
-        # loop through each group, and filter rows that have valid values
-        for group in group_list:
-            # filter all rows that qualify as all triplicates having values
-            filtered = filtered[filtered[group].any(axis=1)]
-
-        # a list containing all the rows to delete
-        del_list = list(filtered.index)
+        intensity_cols = [col for col in list(grouped) if col[0] != 'Info']
+        valid = ~np.isnan(grouped[intensity_cols].to_numpy(dtype=float))
+        keep = valid_rows(valid, [col[0] for col in intensity_cols], min_replicates)
 
         # create a new df, dropping rows with invalid data
-        filtered_df = grouped.drop(del_list)
-        filtered_df.reset_index(drop=True, inplace=True)
+        filtered_df = grouped[keep].reset_index(drop=True)
         filtered = filtered_df.shape[0]
 
         print("Removed invalid rows. " + str(filtered) + " from "
@@ -211,15 +228,17 @@ class RawTables:
 
         self.preimpute_table = filtered_df
     
-    def bait_impute(self, distance=1.8, width=0.3, local=True):
+    @profiling.profile_stage(['preimpute_table'], ['bait_imputed_table'])
+    def bait_impute(self, distance=1.8, width=0.3, local=True, seed=None):
         """
         bait-imputation for sets of data without enough samples.
         This fx imputes a value from a normal distribution of the left-tail
-        of a bait’s capture distribution for the undetected preys using
-        multi-processing.
+        of a bait’s capture distribution for the undetected preys, with one
+        vectorized draw per bait.
             distance: float, distance in standard deviation from the
             mean of the sample distribution upon which to impute. Default = 0
             width: float, width of the distribution to impute in standard deviations. Default = 0.3
+            seed: int, seed for the imputation draws, each bait draws from its own generator
         """
         
         try:
@@ -231,10 +250,14 @@ class RawTables:
         
         self.bait_impute_params = {'distance': distance, 'width': width}
 
+        if isinstance(imputed, replicate_tensor.ReplicateTensor):
+            self.bait_imputed_table = bait_impute_tensor(imputed, distance, width, local,
+                seed)
+            return
+
         # Retrieve all col names that are not classified as Info
         bait_names = [col[0] for col in list(imputed) if col[0] != 'Info']
         baits = list(set(bait_names))
-        bait_series = [imputed[bait].copy() for bait in baits]
         if local:
             global_mean = 0
             global_stdev = 0
@@ -247,32 +270,34 @@ class RawTables:
 
 
 
-        bait_params = zip(
-            bait_series, repeat(distance), repeat(width), repeat(local), repeat(global_mean), repeat(global_stdev))
+        intensity_cols = [col for col in list(imputed) if col[0] != 'Info']
+        values = imputed[intensity_cols].to_numpy(dtype=float)
+        col_baits = np.array([col[0] for col in intensity_cols])
 
-        # Use multiprocessing pool to parallel impute
-        p = Pool()
-        impute_list = p.starmap(pool_impute, bait_params)
-        p.close()
-        p.join()
+        # impute the replicate columns of each bait in place
+        for bait in baits:
+            positions = np.flatnonzero(col_baits == bait)
+            values[:, positions] = bait_impute_values(values[:, positions], distance, width,
+                local, global_mean, global_stdev, rng=seeded_generator(seed, bait))
 
-        for i, bait in enumerate(baits):
-            imputed[bait] = impute_list[i]
+        imputed[intensity_cols] = values
 
         self.bait_imputed_table = imputed
     
-    def prey_impute(self, distance=0, width=0.3, thresh=100):
+    @profiling.profile_stage(['preimpute_table'], ['prey_imputed_table'])
+    def prey_impute(self, distance=0, width=0.3, thresh=100, seed=None):
         """
         default mode of imputation. For protein groups with less than threshold number
         of sample number, impute a value from a normal distribution of the prey’s capture
-        distribution using multi-processing. Note- most protein groups do not need imputation
-        with 12-plate MBR
+        distribution, vectorized over all preys. Note- most protein groups do not need
+        imputation with 12-plate MBR
 
             distance: float, distance in standard deviation from the mean of the
                 sample distribution upon which to impute. Default = 0
             width: float, width of the distribution to impute in standard deviations.
                 Default = 0.3
             threshold: int, max number of samples required for imputation
+            seed: int, seed for the imputation draws
         """
         
         try:
@@ -282,28 +307,20 @@ class RawTables:
                 "before imputation")
             return
         
-        imputed = self.preimpute_table.copy()
-        imputed.drop(columns='Info', inplace=True)
-        imputed = imputed.T
         self.prey_impute_params = {'distance': distance, 'width': width,
             'thresh': thresh}
 
-        # Retrieve all col names that are not classified as Info
-        baits = list(imputed)
-        bait_series = [imputed[bait].copy() for bait in baits]
-        bait_params = zip(
-            bait_series, repeat(distance), repeat(width), repeat(thresh))
-
-        # Use multiprocessing pool to parallel impute
-        p = Pool()
-        impute_list = p.starmap(pool_impute_prey, bait_params)
-        p.close()
-        p.join()
-
-        for i, bait in enumerate(baits):
-            imputed[bait] = impute_list[i]
+        if isinstance(imputed, replicate_tensor.ReplicateTensor):
+            values, _ = imputed.flat()
+            values = prey_impute_values(values.astype(float), distance, width, thresh,
+                rng=seeded_generator(seed, 'prey_impute'))
+            self.prey_imputed_table = imputed.set_flat(values)
+            return
 
-        imputed = imputed.T
+        intensities = self.preimpute_table.drop(columns='Info', level='Baits')
+        values = prey_impute_values(intensities.to_numpy(dtype=float), distance, width,
+            thresh, rng=seeded_generator(seed, 'prey_impute'))
+        imputed = pd.DataFrame(values, index=intensities.index, columns=intensities.columns)
 
         info_cols = [x for x in list(self.preimpute_table) if x[0] == 'Info']
         for col in info_cols:
@@ -312,6 +329,7 @@ class RawTables:
         self.prey_imputed_table = imputed  
     
 
+    @profiling.profile_stage(['grouped_table'], ['bait_matrix'])
     def generate_export_bait_matrix(self):
         """
         Generates and creates a Boolean bait matrix that will be used for control
@@ -340,7 +358,7 @@ class RawTables:
 
 def czb_initial_processing(root, analysis, pg_file='proteinGroups.txt',
     intensity_type='LFQ intensity', bait_impute=True, distance=1.8, width=0.3,
-    thresh=100, local=True):
+    thresh=100, local=True, seed=None, streaming=False, min_replicates=None):
     
     """
     wrapper script for all the pre-processing up to imputation using
@@ -355,15 +373,16 @@ def czb_initial_processing(root, analysis, pg_file='proteinGroups.txt',
     
     # Run all the processing methods
     pyseus_tables = RawTables(root=root,
-        analysis=analysis, intensity_type=intensity_type, pg_file=pg_file)
+        analysis=analysis, intensity_type=intensity_type, pg_file=pg_file,
+        streaming=streaming)
     pyseus_tables.filter_table()
     pyseus_tables.transform_intensities(func=np.log2)
     pyseus_tables.group_replicates(intensity_re=r'_\d+$', reg_exp=r'(.*_.*)_\d+$')
-    pyseus_tables.remove_invalid_rows()
+    pyseus_tables.remove_invalid_rows(min_replicates=min_replicates)
     if bait_impute:
-        pyseus_tables.bait_impute(distance=distance, width=width, local=local)
+        pyseus_tables.bait_impute(distance=distance, width=width, local=local, seed=seed)
     else:
-        pyseus_tables.prey_impute(distance=distance, width=width, thresh=thresh)
+        pyseus_tables.prey_impute(distance=distance, width=width, thresh=thresh, seed=seed)
     pyseus_tables.generate_export_bait_matrix()
     pyseus_tables.save()
     return pyseus_tables
@@ -371,11 +390,58 @@ def czb_initial_processing(root, analysis, pg_file='proteinGroups.txt',
 
 def load_raw_tables(file_dir):
     """
-    use pickle to load RawTables class
+    use pickle to load RawTables class, or open a columnar save directory
+    whose tables are loaded lazily
     """
+    if os.path.isdir(file_dir):
+        return stage_store.load_object(RawTables, file_dir)
     return pickle.load(open(file_dir, 'rb', -1))
 
-        
+
+def read_protein_groups(file_dir, intensity_type, info_cols=['Protein IDs',
+    'Majority protein IDs', 'Protein names', 'Gene names'], filter_cols=[
+    'Potential contaminant', 'Only identified by site', 'Reverse'], chunksize=100000,
+    dtype=np.float32, verbose=True):
+    """
+    Streaming reader for MaxQuant proteinGroups.txt. The header is scanned first
+    to resolve the info, QC filter and intensity columns, and only those are read,
+    with intensities as dtype. Rows flagged in any of the filter columns are
+    dropped chunk by chunk, so memory scales with the kept data rather than the
+    raw file. The filter columns are kept (now empty) so that filter_table
+    can run unchanged on the result.
+
+    rtype: pd DataFrame
+    """
+    header = list(pd.read_csv(file_dir, sep='\t', header=0, nrows=0))
+    intensity_cols = select_intensity_cols(header, intensity_type)
+    filter_cols = [col for col in filter_cols if col in header]
+    keep = set(info_cols + filter_cols + intensity_cols)
+
+    # column order of the original file
+    use_cols = [col for col in header if col in keep]
+    dtypes = {col: dtype for col in intensity_cols}
+    dtypes.update({col: str for col in filter_cols})
+
+    reader = pd.read_csv(file_dir, sep='\t', header=0, usecols=use_cols, dtype=dtypes,
+        chunksize=chunksize)
+
+    chunks = []
+    pre_filter = 0
+    for chunk in reader:
+        pre_filter += chunk.shape[0]
+        chunk = chunk[chunk[filter_cols].isna().all(axis=1)]
+        chunks.append(chunk)
+
+    ms_table = pd.concat(chunks)[use_cols]
+
+    if verbose:
+        print("Filtered " + str(pre_filter - ms_table.shape[0]) + ' of '
+            + str(pre_filter) + ' rows while reading. Now '
+            + str(ms_table.shape[0]) + ' rows.')
+
+    return ms_table
+
+
 def select_intensity_cols(orig_cols, intensity_type):
     """from table column names, return a list of only intensity cols
     rtype: intensity_cols list """
@@ -398,14 +464,140 @@ def select_intensity_cols(orig_cols, intensity_type):
     return intensity_cols
 
 
-def pool_impute(bait_group, distance=1.8, width=0.3, local=True, global_mean=0, global_stdev=0):
-    """target for multiprocessing pool from multi_impute_nans"""
-    all_vals = bait_group.stack()
-    mean = all_vals.mean()
-    stdev = all_vals.std()
-    
+def valid_rows(valid, col_groups, min_replicates=None):
+    """
+    Row mask of a (preys x samples) validity array, True for rows where at least
+    one group has all its replicates valid, or at least min_replicates of them.
+    Valid replicates are counted for all groups at once with one reduceat over
+    the columns ordered by group, so groups may have any number of replicates.
+        col_groups: list, group of each column
+
+    rtype: np.array of booleans
+    """
+    col_groups = np.asarray(col_groups)
+    if len(col_groups) == 0:
+        return np.zeros(valid.shape[0], dtype=bool)
+
+    order = np.argsort(col_groups, kind='stable')
+    groups, starts, sizes = np.unique(col_groups[order], return_index=True,
+        return_counts=True)
+
+    counts = np.add.reduceat(valid[:, order].astype(np.int32), starts, axis=1)
+    if min_replicates is None:
+        required = sizes
+    else:
+        required = np.minimum(min_replicates, sizes)
+
+    return (counts >= required).any(axis=1)
+
+
+def replicate_group_names(col_names, intensity_re=r'_\d+$', reg_exp=r'(.*_.*)_\d+$'):
+    """
+    Replicate group name of each column, the joined groups of reg_exp for
+    columns matching intensity_re, and 'Info' for the others. Both patterns
+    are compiled once and are case-insensitive.
+
+    rtype: list
+    """
+    intensity_pattern = re.compile(intensity_re, flags=re.IGNORECASE)
+    group_pattern = re.compile(reg_exp, flags=re.IGNORECASE)
+
+    group_names = []
+    for col in col_names:
+        if intensity_pattern.search(col.lower()):
+            group_names.append(''.join(group_pattern.search(col).groups()))
+        else:
+            group_names.append('Info')
+
+    return group_names
+
+
+def transform_values(values, func, dtype=np.float32):
+    """
+    Apply a transformation to a 2D intensity array. Zero intensities are missing
+    values and become nans for any transformation, and -inf values are
+    converted to nans as well.
+
+    rtype: np.array
+    """
+    values[values == 0] = np.nan
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if isinstance(func, np.ufunc):
+            values = func(values, out=values)
+        else:
+            try:
+                transformed = np.asarray(func(values), dtype=dtype)
+                if transformed.shape != values.shape:
+                    raise ValueError
+                values = transformed
+            except (TypeError, ValueError):
+                # function of a single value
+                values = np.vectorize(func, otypes=[dtype])(values)
+
+    values[np.isneginf(values)] = np.nan
+
+    return values
+
+
+def pool_impute(bait_group, distance=1.8, width=0.3, local=True, global_mean=0, global_stdev=0,
+    rng=None):
+    """imputation of a bait group DataFrame, see bait_impute_values"""
+    values = bait_impute_values(bait_group.to_numpy(dtype=float), distance, width, local,
+        global_mean, global_stdev, rng=rng)
+
+    return pd.DataFrame(values, index=bait_group.index, columns=bait_group.columns)
+
+
+def pool_impute_prey(bait_group, distance=0, width=0.3, thresh=100, rng=None):
+    """imputation of a prey Series, see prey_impute_values"""
+    values = prey_impute_values(bait_group.to_numpy(dtype=float)[None, :], distance, width,
+        thresh, rng=rng)
+
+    return pd.Series(values[0], index=bait_group.index, name=bait_group.name)
+
+
+def bait_impute_tensor(tensor, distance=1.8, width=0.3, local=True, seed=None):
+    """
+    bait_impute of a ReplicateTensor, drawing the same values as bait_impute on
+    the table layout. Values are imputed in float64 and stored in the dtype of
+    the tensor.
+
+    rtype: ReplicateTensor
+    """
+    imputed = tensor.copy()
+    global_mean = 0
+    global_stdev = 0
+    if not local:
+        valid = tensor.values[~np.isnan(tensor.values)].astype(float)
+        global_mean = valid.mean()
+        global_stdev = valid.std(ddof=1)
+
+    for b, bait in enumerate(tensor.baits):
+        n = tensor.n_replicates[b]
+        imputed.values[:, b, :n] = bait_impute_values(tensor.values[:, b, :n].astype(float),
+            distance, width, local, global_mean, global_stdev,
+            rng=seeded_generator(seed, bait))
+
+    return imputed
+
+
+def bait_impute_values(values, distance=1.8, width=0.3, local=True, global_mean=0,
+    global_stdev=0, rng=None):
+    """
+    Impute all the nans of a bait's (preys x replicates) intensity array with a single
+    draw from the left-tail distribution of the bait, or from the global distribution
+    if local is False. Real values are rounded to the 4th decimal digit.
+
+    rtype: np.array
+    """
+    all_vals = values[~np.isnan(values)]
+
     if local:
         # get imputation distribution mean and stdev
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = all_vals.mean()
+            stdev = all_vals.std(ddof=1)
         imp_mean = mean - distance * stdev
         imp_stdev = stdev * width
     else:
@@ -413,51 +605,73 @@ def pool_impute(bait_group, distance=1.8, width=0.3, local=True, global_mean=0,
         imp_mean = global_mean
         imp_stdev = global_stdev
 
+    return random_imputation_vals(values, imp_mean, imp_stdev, rng)
 
-    # copy a df of the group to impute values
-    bait_df = bait_group.copy()
-
-    # loop through each column in the group
-    for col in list(bait_df):
-        bait_df[col] = bait_df[col].apply(random_imputation_val,
-            args=(imp_mean, imp_stdev))
-    return bait_df
-
-
-def pool_impute_prey(bait_group, distance=0, width=0.3, thresh=100):
-    """target for multiprocessing pool from multi_impute_nans"""
 
-    if bait_group.count() > thresh:
-        return bait_group
+def prey_impute_values(values, distance=0, width=0.3, thresh=100, rng=None):
+    """
+    Impute the nans of each prey's row of a (preys x samples) intensity array that
+    has no more than thresh valid samples, from a normal distribution of the prey's
+    capture distribution. All imputed values are drawn at once. Rows with more
+    valid samples than thresh are returned as they are.
 
+    rtype: np.array
+    """
+    values = values.copy()
+    valid = ~np.isnan(values)
+    counts = valid.sum(axis=1)
+    rows = counts <= thresh
 
-    mean = bait_group.mean()
-    stdev = bait_group.std()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sums = np.where(valid, values, 0).sum(axis=1)
+        mean = sums / counts
+        sq_devs = np.where(valid, values - mean[:, None], 0) ** 2
+        stdev = np.sqrt(sq_devs.sum(axis=1) / (counts - 1))
 
     # get imputation distribution mean and stdev
     imp_mean = mean - distance * stdev
     imp_stdev = stdev * width
 
-    # copy a df of the group to impute values
-    bait_df = bait_group.copy()
+    values[rows] = random_imputation_vals(values[rows], imp_mean[rows, None],
+        imp_stdev[rows, None], rng)
 
+    return values
 
-    bait_df = bait_df.apply(random_imputation_val,
-            args=(imp_mean, imp_stdev))
-    return bait_df
 
+def random_imputation_vals(values, mean, std, rng=None):
+    """from a normal distribution take random samples for all the np.nans
+    of an array in one draw. Real values are rounded to 4th decimal digit.
+    Floats with longer digits will be 'barcoded' by further digits.
+        mean, std: float or array broadcastable to values
 
-def random_imputation_val(x, mean, std):
-    """from a normal distribution take a random sample if input is
-    np.nan. For real values, round to 4th decimal digit.
-    Floats with longer digits will be 'barcoded' by further digits
+    rtype: np.array"""
 
-    rtype: float"""
+    if rng is None:
+        rng = np.random.default_rng()
+
+    imputed = np.round(values, 4)
+    missing = np.isnan(imputed)
+
+    mean = np.broadcast_to(mean, imputed.shape)[missing]
+    std = np.broadcast_to(std, imputed.shape)[missing]
+    imputed[missing] = rng.normal(mean, std)
+
+    return imputed
+
+
+def seeded_generator(seed, key):
+    """
+    numpy Generator for a bait (or prey) key. With a seed, the draws made for a
+    key are reproducible regardless of the order or process they are made in.
+    Without a seed, the generator is seeded from fresh entropy.
+
+    rtype: np.random.Generator
+    """
+    if seed is None:
+        return np.random.default_rng()
+
+    return np.random.default_rng([seed, zlib.crc32(str(key).encode())])
 
-    if np.isnan(x):
-        return np.random.normal(mean, std, 1)[0]
-    else:
-        return np.round(x, 4)
 
 def sample_rename(col_names, RE, replacement_RE, repl_search=False):
     """
@@ -524,35 +738,73 @@ def rename_columns(df, RE, replacement_RE, repl_search=False):
     return renamed
 
 
-def median_replicates(imputed_df, mean=False, save_info=True, col_str=''):
+def median_replicates(imputed_df, mean=False, save_info=True, col_str='', as_array=False):
     """For each bait group, calculate the median of the replicates
     and returns a df of median values
+        imputed_df: DataFrame or ReplicateTensor
+        as_array: boolean, return the (preys x baits) medians as an array,
+            with the bait labels and the row index, instead of a DataFrame
 
     rtype: median_df pd dataframe"""
 
-    imputed_df = imputed_df.copy()
-    # retrieve bait names
-    bait_names = [col[0] for col in list(imputed_df) if col[0] != 'Info']
-    bait_names = list(set(bait_names))
-    # initiate a new df for medians
-    median_df = pd.DataFrame()
-
-    # for each bait calculate medain across replicates and add
-    # to the new df
-    for bait in bait_names:
-        if mean:
-            bait_median = imputed_df[bait].mean(axis=1)
-        else:
-            bait_median = imputed_df[bait].median(axis=1)
-        new_col_name = col_str + bait
-        median_df[new_col_name] = bait_median
+    tensor = replicate_tensor.as_tensor(imputed_df, dtype=intensity_dtype(imputed_df))
+    medians = replicate_medians(tensor, mean=mean).copy()
+    baits = np.array([col_str + bait for bait in tensor.baits], dtype=object)
+
+    if as_array:
+        return medians, baits, tensor.info.index
 
+    median_df = pd.DataFrame(medians, index=tensor.info.index, columns=baits)
     if save_info:
-        # get info columns into the new df
-        info = imputed_df['Info']
-        info_cols = list(info)
+        median_df = pd.concat([median_df, tensor.info], axis=1)
 
-        for col in info_cols:
-            median_df[col] = info[col]
+    return median_df
+
+
+# medians of the most recent replicate tables, by content fingerprint
+MEDIAN_CACHE = collections.OrderedDict()
+MEDIAN_CACHE_SIZE = 4
+
+
+def replicate_medians(tensor, mean=False):
+    """
+    (preys x baits) nan-aware median, or mean, over the replicate axis of a
+    ReplicateTensor, memoized by the tensor's values and labels so that the
+    heatmap functions share one computation per imputed table
+
+    rtype: np.array, read-only
+    """
+    digest = hashlib.sha1()
+    digest.update(np.ascontiguousarray(tensor.values).tobytes())
+    digest.update(str(tensor.values.shape).encode())
+    digest.update('\n'.join(map(str, tensor.baits)).encode())
+    digest.update('\n'.join(map(str, tensor.replicates.ravel())).encode())
+    digest.update(pd.util.hash_array(tensor.info.index.to_numpy()).tobytes())
+    digest.update(str(mean).encode())
+    key = digest.hexdigest()
+
+    if key in MEDIAN_CACHE:
+        MEDIAN_CACHE.move_to_end(key)
+        return MEDIAN_CACHE[key]
+
+    medians = tensor.medians(mean=mean)
+    medians.setflags(write=False)
+
+    MEDIAN_CACHE[key] = medians
+    if len(MEDIAN_CACHE) > MEDIAN_CACHE_SIZE:
+        MEDIAN_CACHE.popitem(last=False)
+
+    return medians
+
+
+def intensity_dtype(table):
+    """
+    Common dtype of the intensity columns of a (Baits, Replicates) table, so
+    that the replicate medians keep the table's precision
+    """
+    if isinstance(table, replicate_tensor.ReplicateTensor):
+        return table.values.dtype
 
-    return median_df
\ No newline at end of file
+    # integer intensities are promoted to floats to hold the nan padding
+    dtypes = [dtype for col, dtype in table.dtypes.items() if col[0] != 'Info']
+    return np.result_type(np.float32, *dtypes)
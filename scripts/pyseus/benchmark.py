@@ -0,0 +1,307 @@
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+from pyseus import basic_processing as pys
+from pyseus import primary_analysis as pa
+from pyseus import validation_analysis as va
+from pyseus import profiling
+
+
+def synthetic_protein_groups(n_baits=24, n_preys=2000, n_replicates=3, missing=0.3,
+    n_plates=2, hit_rate=0.02, intensity_type='LFQ intensity', seed=0):
+    """
+    Generate a MaxQuant-style proteinGroups table of an IP-MS experiment, with
+    'P01_GENE_01'-style replicate intensity columns, a small fraction of
+    contaminant/reverse/site-only rows, missing values as zeros, and a few
+    enriched preys per bait.
+        n_baits: int, number of baits (pulldowns)
+        n_preys: int, number of protein groups
+        n_replicates: int, replicates per bait
+        missing: float, fraction of missing intensities
+        n_plates: int, number of plates the baits are spread over
+        hit_rate: float, fraction of enriched preys per bait
+
+    rtype: DataFrame
+    """
+    rng = np.random.default_rng(seed)
+
+    genes = np.array(['GENE' + str(i) for i in range(n_preys)], dtype=object)
+    ids = np.array(['P' + str(i).zfill(6) for i in range(n_preys)], dtype=object)
+
+    def flags(rate):
+        return np.where(rng.random(n_preys) < rate, '+', None)
+
+    info = pd.DataFrame({
+        'Protein IDs': ids,
+        'Majority protein IDs': ids,
+        'Protein names': 'protein ' + pd.Series(genes),
+        'Gene names': genes,
+        'Only identified by site': flags(0.01),
+        'Reverse': flags(0.01),
+        'Potential contaminant': flags(0.01)})
+
+    # log2 prey abundance, shared by all pulldowns
+    abundance = rng.normal(24, 2.5, n_preys)
+
+    # baits are distinct genes of the table, so that targets are found in the
+    # synthetic references
+    bait_genes = genes[rng.choice(n_preys, n_baits, replace=False)]
+
+    columns = []
+    values = []
+    for i, bait in enumerate(bait_genes):
+        plate = 'P' + str(i % n_plates + 1).zfill(2)
+        enriched = np.where(rng.random(n_preys) < hit_rate, rng.normal(4, 1.5, n_preys), 0)
+
+        for rep in range(1, n_replicates + 1):
+            columns.append(intensity_type + ' ' + plate + '_' + bait + '_' + str(rep).zfill(2))
+            values.append(abundance + enriched + rng.normal(0, 0.6, n_preys))
+
+    intensities = np.exp2(np.array(values).T)
+    intensities[rng.random(intensities.shape) < missing] = 0
+    intensities = pd.DataFrame(intensities, columns=columns)
+
+    return pd.concat([info, intensities], axis=1)
+
+
+def synthetic_references(genes, n_complexes=200, complex_size=5, n_classes=12, seed=0):
+    """
+    CORUM-style interaction table and localization table for a list of genes,
+    used for the precision-recall stage
+
+    rtype: corum DataFrame, localization DataFrame
+    """
+    rng = np.random.default_rng(seed)
+    genes = np.asarray(genes, dtype=object)
+
+    pairs = []
+    for _ in range(n_complexes):
+        members = rng.choice(genes, complex_size, replace=False)
+        for i in range(complex_size):
+            for j in range(i + 1, complex_size):
+                pairs.append(sorted([members[i], members[j]]))
+    corum = pd.DataFrame(pairs, columns=['prot_1', 'prot_2']).drop_duplicates()
+
+    classes = ['B'] + ['class' + str(i) for i in range(n_classes)]
+    localization = pd.DataFrame({
+        'gene_names': genes,
+        'mnc_classifier': ['/'.join(rng.choice(classes, rng.integers(1, 3), replace=False))
+            for _ in range(len(genes))]})
+
+    return corum.reset_index(drop=True), localization
+
+
+def time_stage(results, stage, func, rows):
+    """
+    Run a stage, record its wall time, peak RSS and throughput in rows per
+    second, and return the stage's output
+    """
+    sampler = profiling.RSSSampler()
+    start = time.perf_counter()
+    output = func()
+    wall = time.perf_counter() - start
+    peak = sampler.stop()
+
+    results[stage] = {
+        'wall_time': wall,
+        'peak_rss_mb': peak / 2**20 if peak is not None else None,
+        'rows': int(rows),
+        'throughput': rows / wall if wall > 0 else None
+    }
+    print(stage + ': ' + str(round(wall, 3)) + ' s')
+
+    return output
+
+
+def run_scale(n_baits, n_preys, n_replicates=3, missing=0.3, engine='vectorized',
+    seed=0, work_dir=None):
+    """
+    Time every pyseus stage on a synthetic dataset of one scale, from reading
+    the proteinGroups table to the precision-recall curve
+        work_dir: str, directory of the synthetic analysis, a temporary
+            directory removed afterwards if None
+
+    rtype: dict, stage to timing record
+    """
+    temporary = work_dir is None
+    if temporary:
+        work_dir = tempfile.mkdtemp(prefix='pyseus_benchmark_')
+    try:
+        return time_stages(work_dir, n_baits, n_preys, n_replicates, missing, engine, seed)
+    finally:
+        if temporary:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def time_stages(work_dir, n_baits, n_preys, n_replicates, missing, engine, seed):
+    """
+    Stages of run_scale, with the synthetic proteinGroups table written to work_dir
+    """
+    root = work_dir.rstrip('/') + '/'
+    analysis = 'benchmark'
+    if not os.path.isdir(root + analysis):
+        os.makedirs(root + analysis)
+
+    pg = synthetic_protein_groups(n_baits, n_preys, n_replicates, missing, seed=seed)
+    pg.to_csv(root + 'proteinGroups.txt', sep='\t', index=False)
+    corum, localization = synthetic_references(pg['Gene names'], seed=seed)
+
+    results = {}
+    raw = time_stage(results, 'read', lambda: pys.RawTables(root, analysis, 'LFQ intensity'),
+        n_preys)
+    time_stage(results, 'filter', lambda: raw.filter_table(verbose=False), n_preys)
+
+    rows = raw.filtered_table.shape[0]
+    time_stage(results, 'transform', raw.transform_intensities, rows)
+    time_stage(results, 'group', raw.group_replicates, rows)
+    time_stage(results, 'remove_invalid', raw.remove_invalid_rows, rows)
+
+    rows = raw.preimpute_table.shape[0]
+    time_stage(results, 'bait_impute', lambda: raw.bait_impute(seed=seed), rows)
+    time_stage(results, 'prey_impute', lambda: raw.prey_impute(seed=seed), rows)
+    time_stage(results, 'bait_matrix', raw.generate_export_bait_matrix, n_baits)
+
+    analysis_tables = pa.AnalysisTables(root, analysis, raw.bait_imputed_table,
+        raw.bait_matrix)
+    time_stage(results, 'enrichment',
+        lambda: analysis_tables.simple_pval_enrichment(engine=engine), rows * n_baits)
+    time_stage(results, 'standard_table', analysis_tables.convert_to_standard_table,
+        rows * n_baits)
+
+    hits = analysis_tables.standard_hits_table
+    validation = va.Validation(hits, 'target', 'prey', corum, localization)
+    time_stage(results, 'static_fdr', lambda: validation.static_fdr(3, 2), hits.shape[0])
+    time_stage(results, 'dynamic_fdr', validation.dynamic_fdr, hits.shape[0])
+    time_stage(results, 'unique_interactions',
+        lambda: validation.convert_to_unique_interactions(get_edge=True),
+        validation.interaction_table.shape[0])
+
+    # precision_recall lives next to pyseus in the scripts directory
+    scripts_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    sys.path.append(os.path.join(scripts_dir, 'interactome_precision_recall'))
+    import precision_recall
+
+    curve = time_stage(results, 'precision_recall',
+        lambda: precision_recall.precision_recall_curve(hits, 'target', 'prey', corum,
+            localization, 100), hits.shape[0])
+
+    # a nan curve means no target was found in the references, and the validation
+    # stages timed an empty path. The highest threshold calls no interactions.
+    called = curve.iloc[:-1]
+    if not (np.isfinite(called['precision']).all() and np.isfinite(called['recall']).all()):
+        raise RuntimeError("benchmark precision-recall curve is not finite")
+
+    return results
+
+
+def run_benchmark(scales, n_replicates=3, missing=0.3, engine='vectorized', seed=0):
+    """
+    Run the benchmark at several (n_baits, n_preys) scales
+
+    rtype: dict, scale label to stage timing records
+    """
+    benchmark = {}
+    for n_baits, n_preys in scales:
+        label = str(n_baits) + 'x' + str(n_preys)
+        print('Benchmarking ' + str(n_baits) + ' baits and ' + str(n_preys) + ' preys..')
+        benchmark[label] = run_scale(n_baits, n_preys, n_replicates, missing, engine, seed)
+
+    return benchmark
+
+
+def compare_to_baseline(benchmark, baseline, tolerance=0.25, min_time=0.05):
+    """
+    Compare the wall times and peak RSS of a benchmark to a stored baseline.
+    A stage regresses if it is more than tolerance slower (or larger) than
+    the baseline, ignoring stages faster than min_time seconds in both.
+
+    rtype: DataFrame, one row per scale and stage
+    """
+    rows = []
+    for label, stages in benchmark.items():
+        for stage, record in stages.items():
+            base = baseline.get(label, {}).get(stage)
+            row = {'scale': label, 'stage': stage, 'wall_time': record['wall_time'],
+                'peak_rss_mb': record['peak_rss_mb']}
+
+            if base is None:
+                row.update({'baseline_time': None, 'time_ratio': None, 'regression': False})
+                rows.append(row)
+                continue
+
+            ratio = record['wall_time'] / max(base['wall_time'], 1e-9)
+            slower = (ratio > 1 + tolerance) and (record['wall_time'] > min_time)
+
+            larger = False
+            if record['peak_rss_mb'] and base.get('peak_rss_mb'):
+                larger = record['peak_rss_mb'] > base['peak_rss_mb'] * (1 + tolerance)
+
+            row.update({'baseline_time': base['wall_time'], 'time_ratio': ratio,
+                'regression': slower or larger})
+            rows.append(row)
+
+    return pd.DataFrame(rows)
+
+
+def parse_scales(scales):
+    """
+    Parse '24x2000,96x8000' into [(24, 2000), (96, 8000)]
+    """
+    return [tuple(int(n) for n in scale.split('x')) for scale in scales.split(',')]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Time pyseus stages on synthetic IP-MS datasets")
+    parser.add_argument('--scales', default='24x2000,96x5000',
+        help="comma-separated BAITSxPREYS scales")
+    parser.add_argument('--replicates', type=int, default=3)
+    parser.add_argument('--missing', type=float, default=0.3,
+        help="fraction of missing intensities")
+    parser.add_argument('--engine', default='vectorized',
+        help="simple_pval_enrichment engine")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="JSON file to write the results to")
+    parser.add_argument('--baseline', help="baseline JSON file to compare with")
+    parser.add_argument('--save-baseline', action='store_true',
+        help="write the results to the baseline file instead of comparing")
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    args = parser.parse_args()
+
+    benchmark = run_benchmark(parse_scales(args.scales), args.replicates, args.missing,
+        args.engine, args.seed)
+
+    if args.output:
+        with open(args.output, 'w') as file_:
+            json.dump(benchmark, file_, indent=2)
+
+    if args.baseline and args.save_baseline:
+        with open(args.baseline, 'w') as file_:
+            json.dump(benchmark, file_, indent=2)
+        print('Saved baseline to: ' + args.baseline)
+        return
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as file_:
+            baseline = json.load(file_)
+
+    comparison = compare_to_baseline(benchmark, baseline, args.tolerance)
+    print(comparison.to_string(index=False))
+
+    if comparison['regression'].any():
+        print('Regressions found in: ' + ', '.join(
+            comparison[comparison['regression']]['stage'] + ' ('
+            + comparison[comparison['regression']]['scale'] + ')'))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+import os
+from functools import partial
+from multiprocessing import Pool
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Executor:
+    """
+    Executor maps a function over tasks serially, in a thread pool, in a
+    multiprocessing pool, or on a local loky or dask cluster, so that pyseus
+    entry points can be given the parallelism that suits the node they run on.
+    Pools are created for each map call and always shut down afterwards.
+    """
+
+    def __init__(self, kind='process', workers=None, chunksize=None, blas_threads=None,
+        client=None):
+        """
+            kind: str, 'serial', 'thread', 'process', 'loky' or 'dask'
+            workers: int, number of workers, defaults to the number of cpus
+            chunksize: int, number of tasks sent to a worker at once
+            blas_threads: int, limit of BLAS/OpenMP threads in each worker,
+                to avoid oversubscription when workers run numpy code
+            client: dask.distributed Client to use with the 'dask' kind,
+                otherwise a LocalCluster is started for each map call
+        """
+        if kind not in ['serial', 'thread', 'process', 'loky', 'dask']:
+            raise ValueError("kind must be 'serial', 'thread', 'process', 'loky' or 'dask'")
+
+        self.kind = kind
+        self.workers = workers
+        self.chunksize = chunksize
+        self.blas_threads = blas_threads
+        self.client = client
+
+    def map(self, func, iterable, initializer=None, initargs=()):
+        """
+        Return the list of func(task) for each task of iterable. The initializer
+        is called with initargs once per worker process, or once in this process
+        for the serial and thread kinds.
+        """
+        tasks = list(iterable)
+        if len(tasks) == 0:
+            return []
+
+        if self.kind in ['serial', 'thread']:
+            return self.map_in_process(func, tasks, initializer, initargs)
+
+        initargs = (self.blas_threads, initializer, initargs)
+
+        if self.kind == 'process':
+            p = Pool(processes=self.workers, initializer=init_worker, initargs=initargs)
+            try:
+                if self.chunksize:
+                    outputs = p.map(func, tasks, self.chunksize)
+                else:
+                    outputs = p.map(func, tasks)
+                p.close()
+            finally:
+                # no-op once closed, stops the workers if the map failed
+                p.terminate()
+                p.join()
+            return outputs
+
+        if self.kind == 'loky':
+            from loky import get_reusable_executor
+
+            executor = get_reusable_executor(max_workers=self.workers,
+                initializer=init_worker, initargs=initargs)
+            return list(executor.map(func, tasks, chunksize=self.chunksize or 1))
+
+        from dask.distributed import Client, LocalCluster
+
+        client = self.client
+        if client is None:
+            client = Client(LocalCluster(n_workers=self.workers, processes=True))
+        try:
+            client.register_worker_callbacks(partial(init_worker, *initargs))
+            futures = client.map(func, tasks, pure=False,
+                batch_size=self.chunksize)
+            return client.gather(futures)
+        finally:
+            if self.client is None:
+                client.close()
+
+    def starmap(self, func, iterable, initializer=None, initargs=()):
+        """
+        Like map, with each task unpacked as the arguments of func
+        """
+        return self.map(partial(star_call, func), iterable, initializer, initargs)
+
+    def map_in_process(self, func, tasks, initializer, initargs):
+        """
+        Serial and thread maps, with the initializer called once in this process
+        """
+        limits = None
+        if self.blas_threads:
+            from threadpoolctl import threadpool_limits
+            limits = threadpool_limits(limits=self.blas_threads)
+
+        try:
+            if initializer is not None:
+                initializer(*initargs)
+
+            if self.kind == 'serial':
+                return [func(task) for task in tasks]
+
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                return list(executor.map(func, tasks))
+        finally:
+            if limits is not None:
+                limits.restore_original_limits()
+
+
+def get_executor(executor=None):
+    """
+    Executor from an Executor, a kind string, or None for the default
+    multiprocessing pool
+
+    rtype: Executor
+    """
+    if executor is None:
+        return Executor()
+    if isinstance(executor, str):
+        return Executor(kind=executor)
+    return executor
+
+
+def init_worker(blas_threads, initializer, initargs):
+    """
+    Worker initializer that limits BLAS threads before calling the
+    user initializer
+    """
+    if blas_threads:
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(limits=blas_threads)
+        # libraries loaded later in the worker read the thread counts from the environment
+        for var in ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS']:
+            os.environ[var] = str(blas_threads)
+
+    if initializer is not None:
+        initializer(*initargs)
+
+
+def star_call(func, args):
+    """
+    Call func with a tuple of arguments, the picklable counterpart of
+    Pool.starmap for executors that only map
+    """
+    return func(*args)
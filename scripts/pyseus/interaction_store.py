@@ -0,0 +1,219 @@
+import os
+import numpy as np
+import pandas as pd
+
+from pyseus import stage_store
+from pyseus import validation_analysis as va
+
+
+class InteractionStore:
+    """
+    InteractionStore indexes an interaction table (e.g. a standard hits table or a
+    network of called interactions) by target and by prey. Genes are coded in one
+    sorted gene dictionary, and the rows of each target and of each prey are kept
+    as CSR adjacency arrays, so that the preys of a bait, the edges within a set
+    of nodes and the edges between two sets of nodes are found from the rows of
+    the queried genes only, instead of isin masks over the whole table.
+    The store can be saved to a directory and memory-mapped back.
+    """
+
+    def __init__(self, table, genes, target_codes, prey_codes, target_col='target',
+        prey_col='prey', directory=None, indexes=None):
+        """
+            table: DataFrame, the interaction table, rows returned by the queries
+            genes: pd.Index, sorted gene dictionary
+            target_codes, prey_codes: np.array, gene codes of each row, -1 if missing
+            directory: str, directory the store is saved in, if any
+            indexes: dict of the CSR arrays of a saved store, built if None
+        """
+        self.table = table
+        self.genes = genes
+        self.target_codes = target_codes
+        self.prey_codes = prey_codes
+        self.target_col = target_col
+        self.prey_col = prey_col
+        self.directory = directory
+
+        if indexes is None:
+            indexes = {}
+            indexes['target_indptr'], indexes['target_rows'] = csr_index(target_codes,
+                len(genes))
+            indexes['prey_indptr'], indexes['prey_rows'] = csr_index(prey_codes, len(genes))
+
+        self.target_indptr = indexes['target_indptr']
+        self.target_rows = indexes['target_rows']
+        self.prey_indptr = indexes['prey_indptr']
+        self.prey_rows = indexes['prey_rows']
+
+    @classmethod
+    def from_table(cls, table, target_col='target', prey_col='prey'):
+        """
+        Build a store from an interaction table
+        """
+        table = table.reset_index(drop=True)
+        genes, (target_codes, prey_codes) = va.shared_gene_codes(table[target_col],
+            table[prey_col])
+
+        # missing genes are coded -1, not as a 'nan' gene of the string dictionary
+        target_codes = np.where(table[target_col].isna(), -1, target_codes)
+        prey_codes = np.where(table[prey_col].isna(), -1, prey_codes)
+
+        return cls(table, genes, target_codes.astype(np.int32), prey_codes.astype(np.int32),
+            target_col, prey_col)
+
+    def save(self, directory):
+        """
+        Save the store as a StageStore directory: the interaction table in columnar
+        form, and the gene codes and CSR indexes as arrays
+        """
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        store = stage_store.StageStore(directory)
+        store.manifest = {'class': type(self).__name__, 'stages': {}, 'attributes': {
+            'target_col': self.target_col,
+            'prey_col': self.prey_col,
+            'genes': [str(gene) for gene in self.genes],
+            'target_codes': store.write_array('target_codes.npy', self.target_codes),
+            'prey_codes': store.write_array('prey_codes.npy', self.prey_codes),
+            'indexes': {name: store.write_array(name + '.npy', getattr(self, name))
+                for name in ['target_indptr', 'target_rows', 'prey_indptr', 'prey_rows']}}}
+        store.save_table('table', self.table)
+
+        self.directory = directory
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        """
+        Load a saved store, with the interaction table and arrays memory-mapped
+        """
+        store = stage_store.StageStore(directory)
+        attributes = store.manifest['attributes']
+        indexes = {name: store.read_array(file_name, mmap)
+            for name, file_name in attributes['indexes'].items()}
+
+        return cls(store.load_table('table', mmap), pd.Index(attributes['genes']),
+            store.read_array(attributes['target_codes'], mmap),
+            store.read_array(attributes['prey_codes'], mmap),
+            attributes['target_col'], attributes['prey_col'], directory, indexes)
+
+    def __reduce__(self):
+        # a saved store is sent to pool workers as its directory and mapped there
+        if self.directory is not None:
+            return (load_interaction_store, (self.directory,))
+        return (InteractionStore, (self.table, self.genes, self.target_codes,
+            self.prey_codes, self.target_col, self.prey_col))
+
+    def codes(self, nodes):
+        """
+        Unique gene codes of a list of gene names, leaving out unknown genes
+        """
+        codes = self.genes.get_indexer(pd.Index(pd.unique(np.asarray(list(nodes),
+            dtype=object))))
+        return codes[codes >= 0]
+
+    def members(self, nodes):
+        """
+        Boolean membership array of a node set over the gene dictionary, with an
+        extra False slot that missing genes (code -1) look up
+        """
+        member = np.zeros(len(self.genes) + 1, dtype=bool)
+        member[self.codes(nodes)] = True
+        return member
+
+    def target_edges(self, nodes):
+        """
+        Row positions of the interactions of a set of targets
+        """
+        return csr_rows(self.target_indptr, self.target_rows, self.codes(nodes))
+
+    def prey_edges(self, nodes):
+        """
+        Row positions of the interactions of a set of preys
+        """
+        return csr_rows(self.prey_indptr, self.prey_rows, self.codes(nodes))
+
+    def preys_of(self, bait):
+        """
+        Preys of a bait, in table order, without missing prey genes
+
+        rtype: list
+        """
+        rows = np.sort(self.target_edges([bait]))
+        # rows without a prey gene (code -1) are left out
+        codes = self.prey_codes[rows]
+        return self.genes[codes[codes >= 0]].to_list()
+
+    def targets_of(self, prey):
+        """
+        Targets (baits) that pulled down a prey, in table order, without missing
+        target genes
+
+        rtype: list
+        """
+        rows = np.sort(self.prey_edges([prey]))
+        codes = self.target_codes[rows]
+        return self.genes[codes[codes >= 0]].to_list()
+
+    def edges_within(self, nodes, self_edges=True):
+        """
+        Interactions whose target and prey are both in a set of nodes, in table order
+            self_edges: boolean, keep interactions of a node with itself
+
+        rtype: DataFrame
+        """
+        rows = self.target_edges(nodes)
+        rows = rows[self.members(nodes)[self.prey_codes[rows]]]
+        if not self_edges:
+            rows = rows[self.target_codes[rows] != self.prey_codes[rows]]
+
+        return self.table.iloc[np.sort(rows)]
+
+    def edges_between(self, targets, preys):
+        """
+        Interactions from a set of target nodes to a set of prey nodes, in table order
+
+        rtype: DataFrame
+        """
+        rows = self.target_edges(targets)
+        rows = rows[self.members(preys)[self.prey_codes[rows]]]
+
+        return self.table.iloc[np.sort(rows)]
+
+
+def csr_index(codes, n_genes):
+    """
+    CSR index of the rows of each gene code: the rows of gene g are
+    rows[indptr[g]:indptr[g + 1]], in table order. Rows with code -1 are left out.
+
+    rtype: indptr np.array, rows np.array
+    """
+    codes = np.asarray(codes)
+    valid = np.flatnonzero(codes >= 0)
+    rows = valid[np.argsort(codes[valid], kind='stable')]
+
+    indptr = np.zeros(n_genes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(codes[valid], minlength=n_genes), out=indptr[1:])
+
+    return indptr, rows
+
+
+def csr_rows(indptr, rows, codes):
+    """
+    Concatenated rows of a list of gene codes from a CSR index
+    """
+    starts = indptr[codes]
+    lengths = indptr[codes + 1] - starts
+    if lengths.sum() == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    # position of each output row within its gene's slice, offset by the slice start
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return rows[offsets + np.arange(lengths.sum())]
+
+
+def load_interaction_store(directory):
+    """
+    Load a saved InteractionStore, memory-mapped
+    """
+    return InteractionStore.load(directory)
@@ -8,6 +8,7 @@ from plotly import graph_objs as go
 import plotly.figure_factory as ff
 from plotly.subplots import make_subplots
 import math
+from pyseus import primary_analysis as pa
 
 def simple_volcano(v_df, bait, fcd, width=800, height=800):
     """plot the volcano plot of a given bait"""
@@ -16,8 +17,7 @@ def simple_volcano(v_df, bait, fcd, width=800, height=800):
 
     # Specify the bait column
     bait_vals = v_df[bait]
-    bait_vals['thresh'] = bait_vals['enrichment'].apply(calc_thresh,
-        args=[fcd[0], fcd[1]])
+    bait_vals['thresh'] = pa.calc_thresh(bait_vals['enrichment'], fcd[0], fcd[1])
     bait_vals['hits'] = np.where((bait_vals['pvals'] > bait_vals['thresh']), True, False)
     
 
@@ -269,14 +269,6 @@ def mult_volcano(v_df, baits):
 
 
 
-def calc_thresh(enrich, fc_var1, fc_var2):
-    """simple function to get FCD thresh to recognize hits"""
-    if enrich < fc_var2:
-        return np.inf
-    else:
-        return fc_var1 / (abs(enrich) - fc_var2)
-
-
 def two_fdrs(pval_df, fdr1, fdr2):
     """ compute 1% FDR and 5% FDR """
 
@@ -285,25 +277,15 @@ def two_fdrs(pval_df, fdr1, fdr2):
     # get a list of baits
     baits = list(set([x[0] for x in list(pval_df) if x[0] != 'gene_names']))
 
+    # Find hits for FDR1 and FDR2 of all baits at once, (preys x baits) arrays
+    pvals = pval_df[[(bait, 'pvals') for bait in baits]].to_numpy(dtype=float)
+    enrichment = pval_df[[(bait, 'enrichment') for bait in baits]].to_numpy(dtype=float)
+    hits, minor_hits = fdr_hit_masks(pvals, enrichment, fdr1, fdr2)
 
-    # Find hits for FDR1 and FDR2
-    for bait in baits:
-        pval = pval_df[bait]['pvals']
-        enrichment = pval_df[bait]['enrichment']
-        # 1% thresh
-
-        first_thresh = enrichment.apply(calc_thresh,
-            args=[fdr1[0], fdr1[1]])
-
-        # 5% thresh
-        second_thresh = enrichment.apply(calc_thresh,
-            args=[fdr2[0], fdr2[1]])
-
-        pval_df[(bait, 'hits')] = np.where(
-            (pval > first_thresh), True, False)
-
-        pval_df[(bait, 'minor_hits')] = np.where(
-            ((pval < first_thresh) & (pval > second_thresh)), True, False)
+    columns = pd.MultiIndex.from_product([['hits', 'minor_hits'], baits]).swaplevel()
+    hit_df = pd.DataFrame(np.concatenate([hits, minor_hits], axis=1),
+        index=pval_df.index, columns=columns)
+    pval_df = pd.concat([pval_df, hit_df], axis=1)
 
     pval_df.sort_index(axis=1, inplace=True)
     return pval_df
@@ -313,23 +295,27 @@ def all_hits_two_fdrs(pval_df, fdr1, fdr2):
     """ compute 1% fdr and 5 % FDR on all_hits table """
     pval_df = pval_df.copy()
 
-    pval = pval_df['pvals']
-    enrichment = pval_df['enrichment']
-    first_thresh = enrichment.apply(calc_thresh,
-            args=[fdr1[0], fdr1[1]])
+    pval_df['hits'], pval_df['minor_hits'] = fdr_hit_masks(pval_df['pvals'],
+        pval_df['enrichment'], fdr1, fdr2)
+    # pval_df = pval_df[(pval_df['hits']) | (pval_df['minor_hits'])]
+    pval_df.reset_index(inplace=True, drop=True)
+    return pval_df
+
+
+def fdr_hit_masks(pvals, enrichment, fdr1, fdr2):
+    """
+    Major hits above the 1% FDR curve, and minor hits between the 1% and 5% curves
+    """
+    first_thresh = pa.calc_thresh(enrichment, fdr1[0], fdr1[1])
 
     # 5% thresh
-    second_thresh = enrichment.apply(calc_thresh,
-        args=[fdr2[0], fdr2[1]])
+    second_thresh = pa.calc_thresh(enrichment, fdr2[0], fdr2[1])
 
-    pval_df['hits'] = np.where(
-        (pval > first_thresh), True, False)
+    with np.errstate(invalid='ignore'):
+        hits = pvals > first_thresh
+        minor_hits = (pvals < first_thresh) & (pvals > second_thresh)
 
-    pval_df['minor_hits'] = np.where(
-        ((pval < first_thresh) & (pval > second_thresh)), True, False)
-    # pval_df = pval_df[(pval_df['hits']) | (pval_df['minor_hits'])]
-    pval_df.reset_index(inplace=True, drop=True)
-    return pval_df
+    return np.asarray(hits), np.asarray(minor_hits)
 
 
 def comparison_volcano_temp(v_df, bait, width=800, height=400, show=False):
@@ -440,15 +426,7 @@ def comparison_volcano_temp(v_df, bait, width=800, height=400, show=False):
 
 def calc_thresh(enrich, fc_var1, fc_var2):
     """simple function to get FCD thresh to recognize hits"""
-
-    if enrich < fc_var2:
-        return np.inf
-
-    elif (enrich == 0) & (fc_var2 == 0):
-        return np.inf
-
-    else:
-        return fc_var1 / (abs(enrich) - fc_var2)
+    return pa.calc_thresh(enrich, fc_var1, fc_var2)
     # fig.write_image('ignore/old_pickles/1201/' + bait +'.pdf')
 
     # # fig.show()
@@ -6,6 +6,7 @@ from numbers import Number
 import numpy as np
 import pandas as pd
 from pyseus import basic_processing as pys
+from pyseus import replicate_tensor
 import plotly.offline
 from plotly import graph_objs as go
 import seaborn as sns
@@ -13,42 +14,39 @@ import plotly.figure_factory as ff
 from scipy.cluster.hierarchy import linkage, leaves_list
 from sklearn.cluster import KMeans
 import time
+import warnings
 import pdb
 
 
-def subtract_prey_median(imputed_df, mad_mod=True, mad_factor=1):
+def subtract_prey_median(imputed_df, mad_mod=True, mad_factor=1, dtype=np.float32):
     """As an option to visualize clustering so that each intensity
     is subtracted by the prey group median, this function
-    alters the base dataframe with the transformation"""
+    alters the base dataframe with the transformation.
+    With mad_mod, values not above the prey's mean absolute deviation
+    (times mad_factor) are set to 0.
+        dtype: dtype of the transformed intensities"""
 
-    transformed = imputed_df.copy()
+    imputed_df = replicate_tensor.as_table(imputed_df)
+    intensity_cols = imputed_df.columns.get_level_values('Baits') != 'Info'
 
+    # one (preys x samples) block, centered and gated row-wise in place
+    values = imputed_df.loc[:, intensity_cols].to_numpy(dtype=dtype, copy=True)
+    with warnings.catch_warnings():
+        # preys with no valid intensities give nans
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        values -= np.nanmedian(values, axis=1, keepdims=True)
 
-    # Remove info columns for now, will add back again after transformation
-    transformed.drop(columns=['Info'], level='Baits', inplace=True)
-    transformed = transformed.T
-
-    # Get a list of the columns (baits or preys)
-    cols = list(transformed)
-
-    # go through each prey (now in columns) and subtract median
-    for col in cols:
-        transformed[col] = transformed[col] - transformed[col].median()
         if mad_mod:
-            mad = transformed[col].mad() * mad_factor
-            transformed[col] = transformed[col].apply(lambda x: x if x > mad else 0)
+            deviation = np.abs(values - np.nanmean(values, axis=1, keepdims=True))
+            mad = np.nanmean(deviation, axis=1, keepdims=True) * mad_factor
+            # nans fail the comparison and are zeroed as well
+            np.copyto(values, 0, where=~(values > mad))
 
-    transformed = transformed.T
-    # if mad_mod:
-    #     t_cols = list(transformed)
-    #     for col in t_cols:
-    #         mad = transformed[col].mad() * mad_factor
-    #         transformed[col] = transformed[col].apply(lambda x: x if x > mad else 0)
+    transformed = pd.DataFrame(values, index=imputed_df.index,
+        columns=imputed_df.columns[intensity_cols], copy=False)
 
-    # transpose back to original shape and add the info columns again
-    info_cols = list([col for col in list(imputed_df) if col[0] == 'Info'])
-    for col in info_cols:
-        transformed[col] = imputed_df[col]
+    # add the info columns again
+    transformed = pd.concat([transformed, imputed_df.loc[:, ~intensity_cols]], axis=1)
 
     return transformed
 
@@ -191,7 +189,7 @@ def dendro_heatmap(imputed_df, prey_leaves, hexmap, zmin, zmax, bait_leaves=None
         print("Generating Heatmap...")
         start_time = time.time()
 
-    plot_df = imputed_df.copy()
+    plot_df = replicate_tensor.as_table(imputed_df).copy()
 
     # Set index to Protein IDs to match the dendro leaves
     plot_df.set_index(('Info', 'Protein IDs'), inplace=True)
@@ -8,23 +8,32 @@ import itertools
 import scipy
 import random
 import pickle
+import hashlib
+import warnings
 import re
 import pandas as pd
 import numpy as np
 import os
-# from pyseus import basic_processing as pys
+from pyseus import basic_processing as pys
+from pyseus import shared_tables
+from pyseus import stage_store
+from pyseus import executors
+from pyseus import profiling
+from pyseus import replicate_tensor
 from multiprocessing import Queue
 from sklearn.preprocessing import StandardScaler
 from sklearn.decomposition import PCA
 from sklearn.cluster import KMeans
-from itertools import repeat
-from multiprocessing import Pool
 from scipy.spatial.distance import pdist
 from scipy.spatial.distance import squareform
 from scipy.stats import percentileofscore
 from sklearn.metrics.pairwise import cosine_similarity
 
 
+# metric columns of the standard tables stored as booleans
+HIT_COLUMNS = ['hits', 'minor_hits', 'interaction']
+
+
 class AnalysisTables:
     """
     Analysis Tables contains DataFrame objects, functions, and metadata that cover
@@ -40,12 +49,14 @@ class AnalysisTables:
         exclusion_matrix):
 
         # initiate class that cover essential metadata and imputed table
-        # from RawTables class.
+        # from RawTables class, as a table or ReplicateTensor.
          
         self.root = root
         self.analysis = analysis
         self.imputed_table = imputed_table
         self.exclusion_matrix = exclusion_matrix
+        # timing and memory records of the analysis stages
+        self.profiler = profiling.StageProfiler()
 
     def restore_default_exclusion_matrix(self):
         """
@@ -130,42 +141,99 @@ class AnalysisTables:
         self.exclusion_matrix = exclusion
 
 
-    def simple_pval_enrichment(self, std_enrich=True, mean=False):
+    @profiling.profile_stage(['imputed_table'], ['simple_pval_table'])
+    def simple_pval_enrichment(self, std_enrich=True, mean=False, engine='pool',
+        incremental=False, cache_dir=None, executor=None):
         """
         Calculate enrichment and pvals for each bait, no automatic removal
+            engine: str, 'pool' runs the per-prey t-tests of calculate_pval in a
+                multiprocessing pool, 'vectorized' computes all baits and preys
+                at once as masked array operations with identical results
+            incremental: boolean, reuse the saved results of baits whose replicates,
+                exclusion column and effective negative control pool are unchanged,
+                and only calculate the new or changed baits
+            cache_dir: str, directory of the per-bait results, defaults to
+                enrichment_cache in the analysis directory
+            executor: executors.Executor or kind string running the 'pool' engine,
+                defaults to a multiprocessing pool of all cpus
         """
-        imputed = self.imputed_table.copy()
+        # a ReplicateTensor imputed table is used as is by the vectorized engine
+        imputed = imputed_input(self.imputed_table,
+            keep_tensor=(engine == 'vectorized') and not incremental)
         exclusion = self.exclusion_matrix.copy()
 
         # iterate through each cluster to generate neg con group
-        bait_list = [col[0] for col in list(imputed) if col[0] != 'Info']
-        bait_list = list(set(bait_list))   
-          
-        multi_args = zip(bait_list, repeat(imputed),
-        repeat(exclusion), repeat(std_enrich), repeat(mean), repeat(True))
+        bait_list = bait_names(imputed)
+
+        cached = {}
+        calc_list = bait_list
+        if incremental:
+            if cache_dir is None:
+                cache_dir = self.root + self.analysis + '/enrichment_cache'
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+
+            fingerprints = enrichment_fingerprints(bait_list, imputed, exclusion,
+                std_enrich=std_enrich, mean=mean)
+            protein_ids = imputed[('Info', 'Protein IDs')].tolist()
+            for bait in bait_list:
+                output = load_cached_enrichment(cache_dir, fingerprints[bait], bait,
+                    protein_ids)
+                if output is not None:
+                    cached[bait] = output
+            calc_list = [bait for bait in bait_list if bait not in cached]
+            print(str(len(cached)) + " of " + str(len(bait_list))
+                + " baits unchanged, calculating " + str(len(calc_list)) + " baits")
+
+        if len(calc_list) == 0:
+            master_df = None
+
+        elif engine == 'vectorized':
+            print("P-val calculations..")
+            master_df = vectorized_pval_enrichment(calc_list, imputed, exclusion,
+                std_enrich=std_enrich, mean=mean)
+            print("Finished!")
+
+        elif engine == 'pool':
+            # workers attach to the intensities in shared memory, tasks only send bait names
+            shared = shared_tables.SharedMatrix.from_table(imputed,
+                index=imputed[('Info', 'Protein IDs')])
+            worker_args = {'exclusion': exclusion, 'std_enrich': std_enrich, 'mean': mean,
+                'simple': True}
+
+            try:
+                print("P-val calculations..")
+                outputs = executors.get_executor(executor).map(shared_calculate_pval,
+                    calc_list, initializer=shared_tables.init_worker,
+                    initargs=({'imputed': shared.descriptor()}, worker_args))
+                print("Finished!")  
+            finally:
+                shared_tables.release_worker()
+                shared.unlink()
+
+            master_df = pd.concat(outputs, axis=1)
 
-        p = Pool()
-        print("P-val calculations..")
-        outputs = p.starmap(calculate_pval, multi_args)
-        p.close()
-        p.join()
-        print("Finished!")  
+        else:
+            raise ValueError("engine must be either 'pool' or 'vectorized'")
 
-        master_df = pd.concat(outputs, axis=1)
+        if incremental:
+            for bait in calc_list:
+                save_cached_enrichment(cache_dir, fingerprints[bait], master_df[bait])
+            outputs = [cached[bait] if bait in cached else master_df[[bait]]
+                for bait in bait_list]
+            master_df = pd.concat(outputs, axis=1)
 
         # join gene names to the df
-        gene_names = imputed[[('Info', 'Protein IDs'), ('Info', 'Gene names')]]
-        gene_names.set_index(('Info', 'Protein IDs'), drop=True, inplace=True)
-        gene_names.rename(columns={'Info': 'gene_names'}, inplace=True)
-        gene_names.rename(columns={'Gene names': 'gene_names'}, inplace=True)
+        gene_names = gene_name_table(imputed)
 
 
         master_df = pd.concat([master_df, gene_names], axis=1, join='inner')
 
         self.simple_pval_table = master_df
 
+    @profiling.profile_stage(['imputed_table'], ['two_step_pval_table'])
     def two_step_bootstrap_pval_enrichment(self, std_enrich=True, mean=False, thresh=0.001,
-        bootstrap_rep=100):
+        bootstrap_rep=100, engine='pool', seed=None, executor=None):
         """
         The two-step bootstrap pval/enrichment calculations does not use
         an exclusion table of user defined controls. It automatically 
@@ -173,44 +241,78 @@ class AnalysisTables:
         first round, and uses the distribution with dropped outliers
         to calculate bootstrapped null distribution. The null distribution
         of the preys are then used in the second round for pval and enrichment
-        calculation. Uses multi-processing for faster runtime 
+        calculation. Uses multi-processing for faster runtime, or masked
+        array operations over all baits with engine='vectorized'
+            bootstrap_rep: int, number of bootstrap resamples of each prey's controls
+            seed: int, seed for the bootstrap, so that the results are reproducible
+                regardless of the number of workers
+            executor: executors.Executor or kind string running the 'pool' engine,
+                defaults to a multiprocessing pool of all cpus
         """
 
-        imputed = self.imputed_table.copy()
-        bait_list = [col[0] for col in list(imputed) if col[0] != 'Info']
-        bait_list = list(set(bait_list))
-
-        multi_args = zip(bait_list, repeat(imputed), repeat(None), repeat(std_enrich),
-            repeat(mean), repeat(False), repeat(True), repeat(False), repeat(thresh), repeat(False),
-            repeat(None))
-        
-        p = Pool()
-        print("First round p-val calculations..")
-        neg_dfs = p.starmap(calculate_pval, multi_args)
-        p.close()
-        p.join()
-        master_neg = pd.concat(neg_dfs, axis=1)
-        print("First round finished!")    
-
-        self.second_round_neg_control = master_neg.copy()
-        master_neg.reset_index(inplace=True, drop=True)
-
-        multi_args2 = zip(bait_list, repeat(imputed), repeat(None), repeat(std_enrich),
-            repeat(mean), repeat(False), repeat(False), repeat(True), repeat(thresh), repeat(True),
-            repeat(master_neg))
-        
-        print("Second round p-val calculations...")
-        p = Pool()
-        outputs = p.starmap(calculate_pval, multi_args2)
+        imputed = imputed_input(self.imputed_table, keep_tensor=(engine == 'vectorized'))
+        bait_list = bait_names(imputed)
+
+        if engine == 'vectorized':
+            print("First round p-val calculations..")
+            master_neg = vectorized_first_round(bait_list, imputed, std_enrich=std_enrich,
+                mean=mean, thresh=thresh)
+            print("First round finished!")
+
+            self.second_round_neg_control = master_neg.copy()
+            master_neg.reset_index(inplace=True, drop=True)
+
+            print("Second round p-val calculations...")
+            master_df = vectorized_pval_enrichment(bait_list, imputed, None,
+                std_enrich=std_enrich, mean=mean, neg_control=master_neg, bagging=True,
+                bootstrap_rep=bootstrap_rep, seed=seed)
+            print("Second round finished!")
+
+        elif engine == 'pool':
+            # workers attach to the intensities in shared memory, tasks only send bait names
+            shared = shared_tables.SharedMatrix.from_table(imputed,
+                index=imputed[('Info', 'Protein IDs')])
+            worker_args = {'exclusion': None, 'std_enrich': std_enrich, 'mean': mean,
+                'simple': False, 'first_round': True, 'thresh': thresh}
+
+            executor = executors.get_executor(executor)
+            try:
+                print("First round p-val calculations..")
+                neg_dfs = executor.map(shared_calculate_pval, bait_list,
+                    initializer=shared_tables.init_worker,
+                    initargs=({'imputed': shared.descriptor()}, worker_args))
+                master_neg = pd.concat(neg_dfs, axis=1)
+                print("First round finished!")    
+
+                self.second_round_neg_control = master_neg.copy()
+                master_neg.reset_index(inplace=True, drop=True)
+
+                shared_neg = shared_tables.SharedMatrix.from_table(master_neg)
+                worker_args = {'exclusion': None, 'std_enrich': std_enrich, 'mean': mean,
+                    'simple': False, 'second_round': True, 'thresh': thresh, 'bagging': True,
+                    'bootstrap_rep': bootstrap_rep, 'seed': seed}
+
+                try:
+                    print("Second round p-val calculations...")
+                    outputs = executor.map(shared_calculate_pval, bait_list,
+                        initializer=shared_tables.init_worker,
+                        initargs=({'imputed': shared.descriptor(),
+                            'second_round_neg_control': shared_neg.descriptor()}, worker_args))
+                finally:
+                    shared_tables.release_worker()
+                    shared_neg.unlink()
+            finally:
+                shared_tables.release_worker()
+                shared.unlink()
+
+            master_df = pd.concat(outputs, axis=1)
+            print("Second round finished!")
 
-        master_df = pd.concat(outputs, axis=1)
-        print("Second round finished!")
+        else:
+            raise ValueError("engine must be either 'pool' or 'vectorized'")
 
         # join gene names to the df
-        gene_names = imputed[[('Info', 'Protein IDs'), ('Info', 'Gene names')]]
-        gene_names.set_index(('Info', 'Protein IDs'), drop=True, inplace=True)
-        gene_names.rename(columns={'Info': 'gene_names'}, inplace=True)
-        gene_names.rename(columns={'Gene names': 'gene_names'}, inplace=True)
+        gene_names = gene_name_table(imputed)
 
         master_df = pd.concat([master_df, gene_names], axis=1, join='inner')
 
@@ -218,97 +320,131 @@ class AnalysisTables:
 
     
 
+    @profiling.profile_stage(['simple_pval_table', 'two_step_pval_table'],
+        ['standard_hits_table', 'standard_interactors_table'])
     def convert_to_standard_table(self, metrics=['pvals', 'enrichment'], interactors=False,
-            simple_analysis=True):
+            simple_analysis=True, dtype=np.float32):
         """
         the standard table no longer uses column organization for baits. 
         It follows a more SQL-like form where bait information is provided in 
-        separate columns.
+        separate columns. All baits are reshaped at once, with categorical
+        experiment, target, prey and protein_ids columns. Target and prey share
+        the same gene name categories so that they can be compared.
+            interactors: boolean, only keep the hits and minor hits of each bait
+            simple_analysis: boolean, convert the simple_pval_table, or the
+                two_step_pval_table if False
+            dtype: numpy dtype of the metric columns, hit columns
+                ('hits', 'minor_hits', 'interaction') are stored as booleans
         """
         if simple_analysis:
-            pvals = self.simple_pval_table.copy()
-            protein_ids = pvals.index.to_list()
-
-        pvals.set_index(('gene_names', 'gene_names'), inplace=True)
-        pvals.index.name = 'gene_names'
-        targets = pvals.columns.get_level_values('baits')
-        targets = list(set(targets))
-
-        all_hits = []
-        # Get all hits and minor hits along with the metric data
-        for target in targets:
-            target_pvs = pvals[target]
-            target_pvs['protein_ids'] = protein_ids
-
-            # return target_pvs
-            # just_hits bool will return all hits, else it will only return interactors
-            
-            if interactors:
-                selection = ['interactors'] + metrics
-                hits = target_pvs[target_pvs['hits'] | target_pvs['minor_hits']][selection]
-                hits.reset_index(inplace=True)
-            else:
-                hits = target_pvs
-                hits.reset_index(inplace=True)
-
-            hits['experiment'] = target.split('_')[0]
-            hits['target'] = target.split('_')[1]
-            hits.rename(columns={'gene_names': 'prey'}, inplace=True)
-            hits.reset_index(drop=True, inplace=True)
-            all_hits.append(hits)
-
-        all_hits = pd.concat(all_hits, axis=0)
-        col_order = ['experiment', 'target', 'prey', 'protein_ids'] + metrics 
-        all_hits = all_hits[col_order]
-        
+            pvals = self.simple_pval_table
+        else:
+            pvals = self.two_step_pval_table
+
+        gene_names = pvals[('gene_names', 'gene_names')].to_numpy(dtype=object)
+        protein_ids = pd.Categorical(pvals.index.to_numpy(dtype=object))
+        targets = [bait for bait in pd.unique(pvals.columns.get_level_values('baits'))
+            if bait != 'gene_names']
+        n_preys = len(gene_names)
+
+        # experiment and target of each bait, split once per bait
+        experiments = pd.Categorical([target.split('_')[0] for target in targets])
+        target_names = np.array([target.split('_')[1] for target in targets], dtype=object)
+        genes = pd.Index(pd.unique(np.concatenate([target_names, gene_names]))).dropna()
+        genes = genes.sort_values()
+
+        # bait-major long format, the preys of each bait in table order
+        all_hits = pd.DataFrame({
+            'experiment': pd.Categorical.from_codes(np.repeat(experiments.codes, n_preys),
+                categories=experiments.categories),
+            'target': pd.Categorical.from_codes(np.repeat(
+                genes.get_indexer(target_names), n_preys), categories=genes),
+            'prey': pd.Categorical.from_codes(np.tile(genes.get_indexer(gene_names),
+                len(targets)), categories=genes),
+            'protein_ids': pd.Categorical.from_codes(np.tile(protein_ids.codes,
+                len(targets)), categories=protein_ids.categories)
+        })
+        for metric in metrics:
+            all_hits[metric] = stacked_metric(pvals, targets, metric,
+                bool if metric in HIT_COLUMNS else dtype)
+
         if interactors:
+            selection = (stacked_metric(pvals, targets, 'hits', bool)
+                | stacked_metric(pvals, targets, 'minor_hits', bool))
+            all_hits = all_hits[selection].reset_index(drop=True)
             self.standard_interactors_table = all_hits
         else:
             self.standard_hits_table = all_hits
 
 
-    def save(self, option_str=''):
+    def __getattr__(self, name):
+        # tables of a columnar save are only read when first accessed
+        return stage_store.lazy_stage(self, name)
+
+    def __getstate__(self):
+        # a pickle of an object opened from a columnar save holds all of its tables
+        return stage_store.pickle_state(self)
+
+    def save(self, option_str='', columnar=False):
         """
-        save class to a designated directory
+        save class to a designated directory. With columnar, every table is saved
+        as a separate stage of a StageStore directory instead of a single pickle
         """
         analysis_dir = self.root + self.analysis
         if len(option_str) > 0:
             option_str = '_' + option_str
-        file_dir = analysis_dir + "/pval_tables" + option_str + '.pkl' 
+        file_dir = analysis_dir + "/pval_tables" + option_str
+        if not columnar:
+            file_dir += '.pkl'
         if not os.path.isdir(analysis_dir):
             print(analysis_dir)
             print('Directory does not exist! Creating new directory')
             os.mkdir(analysis_dir)
 
         print("Saving to: " + file_dir)
-        with open(file_dir, 'wb') as file_:
-            pickle.dump(self, file_, -1)
+        if columnar:
+            stage_store.save_object(self, file_dir)
+        else:
+            with open(file_dir, 'wb') as file_:
+                pickle.dump(self, file_, -1)
+
+
+def load_analysis_tables(file_dir):
+    """
+    use pickle to load AnalysisTables class, or open a columnar save directory
+    whose tables are loaded lazily
+    """
+    if os.path.isdir(file_dir):
+        return stage_store.load_object(AnalysisTables, file_dir)
+    return pickle.load(open(file_dir, 'rb', -1))
 
 
 def calculate_pval(bait, df, exclusion, std_enrich=True, mean=False,
     simple=True, first_round=False, second_round=False, thresh=0.001, bagging=False,
-    second_round_neg_control=None):
+    second_round_neg_control=None, bootstrap_rep=100, seed=None):
     """ General script for pval calculations - encompasses options for 
     simple and two-step bootstrap calculations """
 
-    df = df.copy()
-    excluded = exclusion.copy()
-
-    # initiate other variables required for the fx
-    gene_list = df[('Info', 'Protein IDs')].tolist()
+    # initiate other variables required for the fx, intensity-only tables
+    # (e.g. attached from shared memory) are indexed by Protein IDs
+    if 'Info' in df.columns.get_level_values('Baits'):
+        gene_list = df[('Info', 'Protein IDs')].tolist()
+        temporary = df.drop('Info', level='Baits', axis=1)
+    else:
+        gene_list = df.index.tolist()
+        temporary = df
 
-    # construct a negative control
-    temporary = df.copy()
-    temporary.drop('Info', level='Baits', inplace=True, axis=1)
+    # construct a negative control, only copied when controls are masked below
     if second_round:
-        neg_control = second_round_neg_control.copy()
+        neg_control = second_round_neg_control
+    elif simple:
+        neg_control = temporary.copy()
     else:
-        neg_control = df.copy()
-        neg_control.drop('Info', level='Baits', inplace=True, axis=1)
+        neg_control = temporary
     
     if simple:
         # Get a list of excluded genes
-        excluded = excluded[['Baits', bait]]
+        excluded = exclusion[['Baits', bait]]
         excluded = excluded[excluded[bait] == False]
 
         exclude_list = [bait]
@@ -338,10 +474,17 @@ def calculate_pval(bait, df, exclusion, std_enrich=True, mean=False,
     # perform the p value calculations
     pval_series = pd.Series(bait_series, index=gene_list, name='pvals')
 
+    # get_pvals locates the negative controls of each prey by position
+    control_df = neg_control.T
+    control_df.columns = np.arange(control_df.shape[1])
+
     if simple:
-        pval_series = pval_series.apply(get_pvals, args=[neg_control.T, std_enrich, mean])
+        pval_series = pval_series.apply(get_pvals, args=[control_df, std_enrich, mean])
     else:
-        pval_series = pval_series.apply(get_pvals, args=[neg_control.T, std_enrich, mean, bagging])
+        # each bait draws from its own generator, independent of the pool worker
+        rng = pys.seeded_generator(seed, bait)
+        pval_series = pval_series.apply(get_pvals, args=[control_df, std_enrich, mean, bagging,
+            bootstrap_rep, rng])
 
     pvals, enrichment = pval_series.apply(lambda x: x[0]), pval_series.apply(lambda x: x[1])
     pvals.name = 'pvals'
@@ -376,7 +519,24 @@ def calculate_pval(bait, df, exclusion, std_enrich=True, mean=False,
     
 
 
-def get_pvals(x, control_df, std_enrich, mean=False, bagging=False, bootstrap_rep=100):
+def shared_calculate_pval(bait):
+    """
+    calculate_pval target for pools initialized with shared_tables.init_worker.
+    The imputed table (and the second round negative control) are attached from
+    shared memory once per worker, so each task only receives a bait name.
+    """
+    kwargs = dict(shared_tables.worker_args)
+    df = shared_tables.worker_tables['imputed'].to_frame()
+
+    if 'second_round_neg_control' in shared_tables.worker_tables:
+        neg_control = shared_tables.worker_tables['second_round_neg_control'].to_frame()
+        kwargs['second_round_neg_control'] = neg_control
+
+    return calculate_pval(bait, df, **kwargs)
+
+
+def get_pvals(x, control_df, std_enrich, mean=False, bagging=False, bootstrap_rep=100,
+    rng=None):
     """This is an auxillary function to calculate p values
     that is used in enrichment_pval_dfs function
 
@@ -387,22 +547,12 @@ def get_pvals(x, control_df, std_enrich, mean=False, bagging=False, bootstrap_re
     neg_con = np.array(control_df[row].values.tolist())
 
     if bagging:
-        orig_len = len(neg_con)
-        con_dropped = tuple(neg_con[~np.isnan(neg_con)])
-        dropped_con = list(con_dropped)
-
-        # bootstrap sampling       
-        bagged_means = []
-        bagged_stds = []
-        for _ in bootstrap_rep:
-            bagged_con = np.random.choice(dropped_con, size=orig_len)
-            bagged_means.append(np.mean(bagged_con))
-            bagged_stds.append(np.std(bagged_con))
-        
-        bootstrap_mean = np.mean(bagged_means)
-        bootstrap_std = np.mean(bagged_stds)
+        if rng is None:
+            rng = np.random.default_rng()
 
-        neg_con = np.random.normal(loc=bootstrap_mean, scale=bootstrap_std, size=orig_len)
+        # parametrize the prey's null distribution by bootstrap sampling of its controls
+        null_mean, null_std = bootstrap_null_params(neg_con[None, :], bootstrap_rep, rng)
+        neg_con = rng.normal(loc=null_mean[0], scale=null_std[0], size=len(neg_con))
 
 
     pval = scipy.stats.ttest_ind(x[:-1], neg_con,
@@ -429,16 +579,477 @@ def get_pvals(x, control_df, std_enrich, mean=False, bagging=False, bootstrap_re
     return [pval, enrichment]
 
 
-def calc_thresh(enrich, curvature, offset):
-    """simple function to get FCD thresh to recognize hits"""
+def vectorized_pval_enrichment(bait_list, df, exclusion=None, std_enrich=True, mean=False,
+    neg_control=None, bagging=False, bootstrap_rep=100, seed=None, equal_var=True,
+    block_size=1024):
+    """
+    Vectorized counterpart of calculate_pval. Instead of one t-test per prey and bait,
+    the replicate and negative control moments of all preys and baits are computed as
+    masked array operations over the intensity block, a block of preys at a time.
+        bait_list: list, baits to calculate pvals and enrichment for
+        df: DataFrame, imputed table with (Baits, Replicates) columns
+        exclusion: DataFrame, exclusion matrix for simple analysis. If None, all samples
+            are used as negative controls, as in the first round of two-step analysis
+        neg_control: DataFrame, negative control intensities for the second round of
+            two-step analysis, replacing the samples of df
+        bagging: boolean, whether to draw the negative controls from the bootstrapped
+            null distribution of each prey
+        seed: int, seed for the bootstrap and the null distribution draws
+        equal_var: boolean, Student's t-test if True, Welch's t-test otherwise
+
+    rtype: DataFrame of enrichment and pvals with (baits, values) columns
+    """
+
+    gene_list = protein_id_list(df)
+    values, col_baits = intensity_block(df)
+    bait_weights = (col_baits[:, None] == np.array(bait_list)[None, :]).astype(float)
+
+    always = None
+    if neg_control is not None:
+        control, control_baits = intensity_block(neg_control)
+        control_weights = np.ones((control.shape[1], len(bait_list)))
+    elif exclusion is not None:
+        control = values
+        control_weights, always = exclusion_weights(bait_list, exclusion, col_baits, values)
+    else:
+        control = values
+        control_weights = np.ones((control.shape[1], len(bait_list)))
 
-    if enrich < offset:
-        return np.inf
+    if bagging:
+        # the null distribution of a prey does not depend on the bait, so it is
+        # bootstrapped once, and each bait draws from it with its own generator
+        null_means, null_stds = bootstrap_null_params(control, bootstrap_rep,
+            pys.seeded_generator(seed, 'bootstrap'))
+        rngs = [pys.seeded_generator(seed, bait) for bait in bait_list]
+
+    pvals = np.empty((len(gene_list), len(bait_list)))
+    enrichment = np.empty((len(gene_list), len(bait_list)))
+
+    for start in np.arange(0, len(gene_list), block_size):
+        block = slice(start, start + block_size)
+        bait_block = values[block]
+        bait_moments = masked_moments(bait_block, bait_weights)
+
+        if bagging:
+            # a fresh null sample is drawn for each bait, as in get_pvals
+            for j in np.arange(len(bait_list)):
+                null = rngs[j].normal(loc=null_means[block, None], scale=null_stds[block, None],
+                    size=bait_block.shape[:1] + control.shape[1:])
+                control_moments = masked_moments(null, np.ones((null.shape[1], 1)))
+                if not mean:
+                    bait_median = np.nanmedian(bait_block[:, bait_weights[:, j] > 0], axis=1)
+                    control_median = np.nanmedian(null, axis=1)
+                    medians = bait_median[:, None], control_median[:, None]
+                else:
+                    medians = None
+                moments = [[m[:, [j]] for m in bait_moments], control_moments]
+                pvals[block, j], enrichment[block, j] = [result[:, 0] for result in
+                    ttest_enrichment(*moments, medians, std_enrich, mean, equal_var)]
+            continue
+
+        always_block = None if always is None else always[block]
+        control_moments = masked_moments(control[block], control_weights, always_block)
+
+        medians = None
+        if not mean:
+            bait_median = np.empty(pvals[block].shape)
+            control_median = np.empty(pvals[block].shape)
+            for j in np.arange(len(bait_list)):
+                bait_median[:, j] = nanmedian_rows(bait_block[:, bait_weights[:, j] > 0])
+                control_cols = control_weights[:, j] > 0
+                if always_block is None:
+                    control_median[:, j] = nanmedian_rows(control[block][:, control_cols])
+                else:
+                    control_median[:, j] = nanmedian_rows(np.where(
+                        control_cols[None, :] | always_block, control[block], np.nan))
+            medians = bait_median, control_median
+
+        pvals[block], enrichment[block] = ttest_enrichment(bait_moments, control_moments,
+            medians, std_enrich, mean, equal_var)
+
+    # organize into the same layout as concatenated calculate_pval outputs
+    columns = pd.MultiIndex.from_product([bait_list, ['enrichment', 'pvals']],
+        names=['baits', 'values'])
+    output = np.empty((len(gene_list), 2 * len(bait_list)))
+    output[:, 0::2] = enrichment
+    output[:, 1::2] = pvals
+
+    return pd.DataFrame(output, index=gene_list, columns=columns)
+
+
+def vectorized_first_round(bait_list, df, std_enrich=True, mean=False, thresh=0.001):
+    """
+    Vectorized first round of two-step pval calculations. Every sample serves as a
+    negative control, and the preys that come up as hits for a bait are removed
+    from that bait's replicates to form the second round negative control table
+
+    rtype: DataFrame of replicate intensities with hits replaced by np.nans
+    """
 
-    elif (enrich == 0) & (offset == 0):
-        return np.inf
+    gene_list = protein_id_list(df)
+    pe_df = vectorized_pval_enrichment(bait_list, df, None, std_enrich=std_enrich,
+        mean=mean)
 
+    neg_dfs = []
+    for bait in bait_list:
+        enrichment = pe_df[(bait, 'enrichment')].values
+        pvals = pe_df[(bait, 'pvals')].values
+        hits = (enrichment > 0) & (pvals > thresh)
+
+        if isinstance(df, replicate_tensor.ReplicateTensor):
+            b = df.bait_index(bait)
+            neg_series = pd.DataFrame(df.bait(bait).astype(float),
+                columns=df.replicates[b, :df.n_replicates[b]])
+        else:
+            neg_series = df[bait].copy()
+        neg_series.index = gene_list
+        neg_series.columns = pd.MultiIndex.from_product([[bait], neg_series.columns])
+        neg_series[hits] = np.nan
+        neg_dfs.append(neg_series)
+
+    return pd.concat(neg_dfs, axis=1)
+
+
+def enrichment_fingerprints(bait_list, df, exclusion, std_enrich=True, mean=False):
+    """
+    Fingerprint the inputs of the simple pval calculation of each bait: the preys,
+    the bait's replicates, and the samples of its effective negative control pool.
+    Excluded baits only contribute their values above 100, as in calculate_pval,
+    and are left out of the fingerprint if they have none.
+
+    rtype: dict, bait to hex digest
+    """
+    values, col_baits = intensity_block(df)
+    replicates = np.array(['\t'.join(map(str, col)) for col in
+        df.drop('Info', level=0, axis=1).columns], dtype=object)
+    all_baits = sorted(set(col_baits))
+
+    # the preys and options are shared by every fingerprint
+    table = hashlib.sha1()
+    table.update('\n'.join(map(str, df[('Info', 'Protein IDs')])).encode())
+    table.update(str((std_enrich, mean)).encode())
+
+    # digests of each bait's labelled replicates, in full and above 100 only
+    full = {}
+    high = {}
+    for bait in all_baits:
+        cols = col_baits == bait
+        block = np.ascontiguousarray(values[:, cols])
+        labels = '\n'.join(replicates[cols]).encode()
+        full[bait] = hashlib.sha1(labels + block.tobytes()).digest()
+
+        block = np.where(block > 100, block, np.nan)
+        if np.isnan(block).all():
+            high[bait] = None
+        else:
+            high[bait] = hashlib.sha1(labels + block.tobytes()).digest()
+
+    excluded = exclusion.set_index('Baits')[bait_list] == False
+    excluded = excluded.reindex(index=all_baits, fill_value=False)
+
+    fingerprints = {}
+    for bait in bait_list:
+        digest = table.copy()
+        digest.update(bait.encode() + full[bait])
+
+        # only the baits that enter the control pool are hashed
+        for other in all_baits:
+            if other != bait and not excluded.at[other, bait]:
+                digest.update(b'full' + other.encode() + full[other])
+            elif high[other] is not None:
+                digest.update(b'high' + other.encode() + high[other])
+        fingerprints[bait] = digest.hexdigest()
+
+    return fingerprints
+
+
+def load_cached_enrichment(cache_dir, fingerprint, bait, protein_ids):
+    """
+    Load the saved enrichment and pvals of a bait, None if there are no results
+    for the fingerprint
+    """
+    file_dir = os.path.join(cache_dir, fingerprint + '.npy')
+    if not os.path.isfile(file_dir):
+        return None
+
+    columns = pd.MultiIndex.from_product([[bait], ['enrichment', 'pvals']],
+        names=['baits', 'values'])
+    return pd.DataFrame(np.load(file_dir), index=protein_ids, columns=columns)
+
+
+def save_cached_enrichment(cache_dir, fingerprint, output):
+    """
+    Save the enrichment and pvals of a bait under its fingerprint
+    """
+    file_dir = os.path.join(cache_dir, fingerprint + '.npy')
+    values = output[['enrichment', 'pvals']].to_numpy(dtype=float)
+    np.save(file_dir, values, allow_pickle=False)
+
+
+def intensity_block(df):
+    """
+    Return the intensity values of a (Baits, Replicates) table or ReplicateTensor
+    as a float array, and the bait label of each of its columns
+    """
+    if isinstance(df, replicate_tensor.ReplicateTensor):
+        values, col_baits = df.flat()
+        return values.astype(float), col_baits
+
+    if 'Info' in df.columns.get_level_values(0):
+        df = df.drop('Info', level=0, axis=1)
+
+    values = df.to_numpy(dtype=float)
+    col_baits = np.array(df.columns.get_level_values(0))
+
+    return values, col_baits
+
+
+def stacked_metric(pvals, targets, metric, dtype=None):
+    """
+    Values of a metric of a pval table for all targets, stacked target by target
+
+    rtype: np.array
+    """
+    values = pvals[[(target, metric) for target in targets]].to_numpy(dtype=dtype)
+    return values.T.ravel()
+
+
+def imputed_input(imputed, keep_tensor=False):
+    """
+    Copy of an imputed table, with a ReplicateTensor converted to the table
+    layout unless keep_tensor
+    """
+    if isinstance(imputed, replicate_tensor.ReplicateTensor):
+        return imputed if keep_tensor else imputed.to_table(dtype=float)
+    return imputed.copy()
+
+
+def bait_names(imputed):
+    """
+    List of the baits of an imputed table or ReplicateTensor
+    """
+    if isinstance(imputed, replicate_tensor.ReplicateTensor):
+        return list(set(imputed.baits))
+    return list(set([col[0] for col in list(imputed) if col[0] != 'Info']))
+
+
+def protein_id_list(imputed):
+    """
+    List of the Protein IDs of an imputed table or ReplicateTensor
+    """
+    if isinstance(imputed, replicate_tensor.ReplicateTensor):
+        return imputed.info['Protein IDs'].tolist()
+    return imputed[('Info', 'Protein IDs')].tolist()
+
+
+def gene_name_table(imputed):
+    """
+    Gene names of an imputed table or ReplicateTensor indexed by Protein IDs,
+    with a ('gene_names', 'gene_names') column to join to the pval tables
+    """
+    if isinstance(imputed, replicate_tensor.ReplicateTensor):
+        imputed = pd.concat({'Info': imputed.info[['Protein IDs', 'Gene names']]}, axis=1)
+
+    gene_names = imputed[[('Info', 'Protein IDs'), ('Info', 'Gene names')]]
+    gene_names.set_index(('Info', 'Protein IDs'), drop=True, inplace=True)
+    gene_names.rename(columns={'Info': 'gene_names'}, inplace=True)
+    gene_names.rename(columns={'Gene names': 'gene_names'}, inplace=True)
+
+    return gene_names
+
+
+def exclusion_weights(bait_list, exclusion, col_baits, values):
+    """
+    Translate the exclusion matrix to a (columns x baits) weight matrix of the samples
+    used as negative controls for each bait. A bait's own replicates and its excluded
+    baits are dropped, except for values above 100, which calculate_pval keeps.
+
+    rtype: weights np.array, always np.array boolean mask or None
+    """
+    excluded = exclusion.set_index('Baits')[bait_list] == False
+    excluded = excluded.reindex(index=col_baits, fill_value=False).values
+    excluded |= col_baits[:, None] == np.array(bait_list)[None, :]
+
+    always = values > 100
+    if not always.any():
+        always = None
+
+    return (~excluded).astype(float), always
+
+
+def masked_moments(values, weights, always=None):
+    """
+    For each row, the count, mean, and sum of squared deviations of the non-nan values
+    in the columns selected by each column of weights. Values in the always mask
+    are included regardless of the weights. Rows are centered on their mean before
+    summation to keep the squared sums numerically stable.
+
+    rtype: counts, means, sq_devs np.arrays (rows x weight columns)
+    """
+    valid = ~np.isnan(values)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        shift = np.nanmean(values, axis=1, keepdims=True)
+    shift[np.isnan(shift)] = 0
+    centered = np.where(valid, values - shift, 0)
+
+    if always is None:
+        counts = valid @ weights
+        sums = centered @ weights
+        squares = (centered ** 2) @ weights
+    else:
+        fixed = valid & always
+        masked = valid & ~always
+        fixed_centered = np.where(fixed, centered, 0)
+        masked_centered = np.where(masked, centered, 0)
+
+        counts = fixed.sum(axis=1, keepdims=True) + masked @ weights
+        sums = fixed_centered.sum(axis=1, keepdims=True) + masked_centered @ weights
+        squares = (fixed_centered ** 2).sum(axis=1, keepdims=True) \
+            + (masked_centered ** 2) @ weights
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        means = sums / counts
+        sq_devs = np.maximum(squares - sums * means, 0)
+
+    return counts, means + shift, sq_devs
+
+
+def ttest_enrichment(bait_moments, control_moments, medians=None, std_enrich=True,
+    mean=False, equal_var=True):
+    """
+    Two-sided t-test pvals (-log10) and enrichment from the moments computed by
+    masked_moments, following the same definitions as get_pvals.
+        medians: tuple of bait and control median arrays, required if mean is False
+
+    rtype: pvals np.array, enrichment np.array
+    """
+    n1, mean1, sq1 = bait_moments
+    n2, mean2, sq2 = control_moments
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if equal_var:
+            # pooled from the sums of squares, so that a group with a single valid
+            # value contributes no variance instead of 0/0, as in scipy's t-test
+            dof = n1 + n2 - 2
+            svar = (sq1 + sq2) / dof
+            denom = np.sqrt(svar * (1 / n1 + 1 / n2))
+        else:
+            # Welch's variances are undefined for a group with a single valid value
+            valid = (n1 > 1) & (n2 > 1)
+            vn1 = np.where(valid, sq1 / ((n1 - 1) * n1), np.nan)
+            vn2 = np.where(valid, sq2 / ((n2 - 1) * n2), np.nan)
+            dof = (vn1 + vn2) ** 2 / (vn1 ** 2 / (n1 - 1) + vn2 ** 2 / (n2 - 1))
+            denom = np.sqrt(vn1 + vn2)
+
+        t_stat = (mean1 - mean2) / denom
+        pvals = scipy.stats.t.sf(np.abs(t_stat), dof) * 2
+        pvals = -1 * np.log10(pvals)
+
+        if mean:
+            enrichment = mean1 - mean2
+        else:
+            enrichment = medians[0] - medians[1]
+
+        if std_enrich:
+            enrichment = enrichment / np.sqrt(sq2 / n2)
+
+    return pvals, enrichment
+
+
+def nanmedian_rows(values):
+    """np.nanmedian along rows, silencing warnings of all-nan rows"""
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        return np.nanmedian(values, axis=1)
+
+
+def bootstrap_null_params(control, bootstrap_rep=100, rng=None, block_size=None):
+    """
+    For each prey, bootstrap the non-nan negative control intensities and return the
+    mean of the bootstrapped means and stdevs, which parametrize the prey's null
+    distribution in the second round of two-step pval calculations. All
+    bootstrap_rep x n_controls resamples of a block of preys are drawn in one call.
+        control: np.array, (preys x controls) intensities with np.nans
+        rng: np.random.Generator, seeded generator for reproducible draws
+        block_size: int, preys per block, by default sized to ~16M resampled values
+
+    rtype: means np.array, stdevs np.array
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+
+    n_preys, n_controls = control.shape
+    if block_size is None:
+        block_size = max(1, 2 ** 24 // max(bootstrap_rep * n_controls, 1))
+
+    means = np.full(n_preys, np.nan)
+    stdevs = np.full(n_preys, np.nan)
+
+    for start in np.arange(0, n_preys, block_size):
+        block = slice(start, start + block_size)
+
+        # sorting moves np.nans to the end, so the first counts[i] values are valid
+        con_sorted = np.sort(control[block], axis=1)
+        counts = (~np.isnan(con_sorted)).sum(axis=1)
+        valid = counts > 0
+
+        # resample with replacement, keeping the original number of controls
+        draws = rng.integers(0, np.maximum(counts, 1)[:, None, None],
+            size=(con_sorted.shape[0], bootstrap_rep, n_controls))
+        bagged = np.take_along_axis(con_sorted[:, None, :], draws, axis=2)
+
+        block_means = bagged.mean(axis=2).mean(axis=1)
+        block_stds = bagged.std(axis=2).mean(axis=1)
+
+        means[block] = np.where(valid, block_means, np.nan)
+        stdevs[block] = np.where(valid, block_stds, np.nan)
+
+    return means, stdevs
+
+def calc_thresh(enrich, curvature, offset, two_sided=False):
+    """
+    Get FCD thresh to recognize hits. enrich, curvature and offset can be scalars
+    or broadcastable arrays, e.g. a whole enrichment column with a curvature and
+    offset per row, and are thresholded in one pass.
+        two_sided: boolean, also threshold negative enrichments by their
+            magnitude instead of never calling them
+
+    rtype: float or np.array
+    """
+    enrich = np.asarray(enrich, dtype=float)
+    curvature = np.asarray(curvature, dtype=float)
+    offset = np.asarray(offset, dtype=float)
+
+    if two_sided:
+        below = np.abs(enrich) < offset
     else:
-        return curvature / (abs(enrich) - offset)
+        below = (enrich < offset) | ((enrich == 0) & (offset == 0))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        thresh = np.where(below, np.inf, curvature / (np.abs(enrich) - offset))
+
+    if thresh.ndim == 0:
+        return thresh.item()
+    return thresh
+
+
+def fdr_hits(enrich, pvals, fdr, two_sided=False):
+    """
+    Hit mask of pvals above the FCD thresh of their enrichment.
+        fdr: [curvature, offset] pair, or a list of pairs to threshold with
+            several FCD curves at once, adding a last axis with one column per pair
+
+    rtype: np.array boolean
+    """
+    enrich = np.asarray(enrich, dtype=float)
+    pvals = np.asarray(pvals, dtype=float)
+    fdr = np.asarray(fdr, dtype=float)
 
+    if fdr.ndim == 2:
+        enrich = enrich[..., None]
+        pvals = pvals[..., None]
 
+    thresh = calc_thresh(enrich, fdr[..., 0], fdr[..., 1], two_sided=two_sided)
+    with np.errstate(invalid='ignore'):
+        return pvals > thresh
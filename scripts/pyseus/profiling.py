@@ -0,0 +1,188 @@
+import functools
+import json
+import os
+import threading
+import time
+import pandas as pd
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+class StageProfiler:
+    """
+    StageProfiler keeps a record of every profiled pipeline stage run on a
+    RawTables or AnalysisTables object: wall and CPU time, CPU time of pool
+    workers, peak RSS, and the shape of the stage's input and output tables.
+    """
+
+    def __init__(self):
+
+        # list of dicts, one per stage call, in call order
+        self.records = []
+
+    def add(self, record):
+        """
+        Add the record of a stage call
+        """
+        self.records.append(record)
+
+    def summary(self):
+        """
+        Summary table of the recorded stages, one row per stage call
+
+        rtype: DataFrame
+        """
+        return pd.DataFrame(self.records, columns=[
+            'stage', 'started', 'wall_time', 'cpu_time', 'worker_cpu_time',
+            'cpu_utilization', 'peak_rss_mb', 'worker_peak_rss_mb',
+            'rows_in', 'columns_in', 'rows_out', 'columns_out'])
+
+    def to_json(self, file_dir=None):
+        """
+        Export the records as JSON, to file_dir if given
+
+        rtype: str
+        """
+        output = json.dumps(self.records, indent=2)
+        if file_dir is not None:
+            with open(file_dir, 'w') as file_:
+                file_.write(output)
+        return output
+
+    def clear(self):
+        """
+        Remove all records
+        """
+        self.records = []
+
+
+class RSSSampler:
+    """
+    Background thread sampling the resident set size of this process, to find
+    the peak RSS of a single stage rather than of the whole process lifetime
+    """
+
+    def __init__(self, interval=0.01):
+
+        self.interval = interval
+        self.peak = current_rss()
+        self.stopped = threading.Event()
+        self.thread = None
+
+        if self.peak is not None:
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.peak = max(self.peak, current_rss())
+
+    def stop(self):
+        """
+        Stop sampling and return the peak RSS in bytes, None if unavailable
+        """
+        if self.thread is None:
+            return None
+        self.stopped.set()
+        self.thread.join()
+        self.peak = max(self.peak, current_rss())
+        return self.peak
+
+
+def profile_stage(tables_in, tables_out):
+    """
+    Decorator recording a StageProfiler entry on the object's profiler attribute
+    for every call of a pipeline stage method
+        tables_in: list, candidate input table attributes, the first one present
+            is recorded
+        tables_out: list, candidate output table attributes, the first one set
+            by the stage is recorded
+    """
+    def decorator(stage):
+
+        @functools.wraps(stage)
+        def profiled(self, *args, **kwargs):
+            profiler = self.__dict__.get('profiler')
+            if profiler is None:
+                profiler = StageProfiler()
+                self.profiler = profiler
+
+            shape_in = table_shape(self, tables_in)
+            before = {name: id(self.__dict__.get(name)) for name in tables_out}
+
+            started = time.strftime('%Y-%m-%dT%H:%M:%S')
+            sampler = RSSSampler()
+            times = os.times()
+            wall = time.perf_counter()
+            try:
+                return stage(self, *args, **kwargs)
+
+            finally:
+                wall = time.perf_counter() - wall
+                end_times = os.times()
+                peak = sampler.stop()
+
+                cpu = (end_times.user - times.user) + (end_times.system - times.system)
+                worker_cpu = ((end_times.children_user - times.children_user)
+                    + (end_times.children_system - times.children_system))
+
+                changed = [name for name in tables_out
+                    if id(self.__dict__.get(name)) != before[name]]
+                shape_out = table_shape(self, changed)
+
+                profiler.add({
+                    'stage': stage.__name__,
+                    'started': started,
+                    'wall_time': wall,
+                    'cpu_time': cpu,
+                    'worker_cpu_time': worker_cpu,
+                    'cpu_utilization': (cpu + worker_cpu) / wall if wall > 0 else None,
+                    'peak_rss_mb': peak / 2**20 if peak is not None else None,
+                    'worker_peak_rss_mb': worker_peak_rss(),
+                    'rows_in': shape_in[0],
+                    'columns_in': shape_in[1],
+                    'rows_out': shape_out[0],
+                    'columns_out': shape_out[1]
+                })
+
+        return profiled
+
+    return decorator
+
+
+def table_shape(obj, names):
+    """
+    Shape of the first table attribute of obj among names, (None, None) if none
+    """
+    for name in names:
+        try:
+            table = getattr(obj, name)
+        except AttributeError:
+            continue
+        if isinstance(table, pd.DataFrame):
+            return [int(n) for n in table.shape]
+    return [None, None]
+
+
+def current_rss():
+    """
+    Resident set size of this process in bytes, None where /proc is unavailable
+    """
+    try:
+        with open('/proc/self/statm') as file_:
+            return int(file_.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def worker_peak_rss():
+    """
+    Largest peak RSS of any terminated worker process so far, in MB
+    """
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
@@ -0,0 +1,202 @@
+import warnings
+import numpy as np
+import pandas as pd
+
+
+class ReplicateTensor:
+    """
+    ReplicateTensor is a compact form of a (Baits, Replicates) imputed or
+    grouped table. Intensities are kept as one (preys x baits x max replicates)
+    array, NaN-padded for baits with fewer replicates, with the bait, prey and
+    replicate labels as arrays and the 'Info' columns as a side table. Baits
+    are sliced by position instead of by MultiIndex lookups.
+    """
+
+    def __init__(self, values, baits, replicates, info, columns=None):
+        """
+            values: np.array, (preys x baits x max replicates) intensities
+            baits: np.array, bait names along the second axis
+            replicates: np.array, (baits x max replicates) replicate column labels,
+                None for padding
+            info: DataFrame, Info columns, one row per prey
+            columns: MultiIndex, column order of the table, restored by to_table
+        """
+        self.values = values
+        self.baits = np.asarray(baits, dtype=object)
+        self.replicates = np.asarray(replicates, dtype=object)
+        self.info = info
+        self.columns = columns
+
+        # number of replicates of each bait
+        self.n_replicates = (self.replicates != None).sum(axis=1)
+
+    @classmethod
+    def from_table(cls, df, dtype=np.float32):
+        """
+        Build a tensor from a table with (Baits, Replicates) columns. Baits keep
+        the order of their first column, replicates their column order.
+        """
+        intensity_cols = [col for col in list(df) if col[0] != 'Info']
+        col_baits = np.array([col[0] for col in intensity_cols], dtype=object)
+        baits, bait_pos, slot_pos = replicate_slots(col_baits)
+
+        max_replicates = int(slot_pos.max()) + 1 if len(slot_pos) else 0
+        values = np.full((df.shape[0], len(baits), max_replicates), np.nan, dtype=dtype)
+        values[:, bait_pos, slot_pos] = df[intensity_cols].to_numpy(dtype=dtype)
+
+        replicates = np.full((len(baits), max_replicates), None, dtype=object)
+        replicates[bait_pos, slot_pos] = [col[1] for col in intensity_cols]
+
+        if 'Info' in df.columns.get_level_values(0):
+            info = df['Info'].copy()
+        else:
+            info = pd.DataFrame(index=df.index)
+
+        return cls(values, baits, replicates, info, df.columns)
+
+    def to_table(self, dtype=None):
+        """
+        Convert back to the (Baits, Replicates) table layout
+
+        rtype: DataFrame
+        """
+        block, col_baits = self.flat()
+        if dtype is not None:
+            block = block.astype(dtype)
+
+        bait_pos, slot_pos = self.column_positions()
+        columns = pd.MultiIndex.from_arrays([col_baits, self.replicates[bait_pos, slot_pos]],
+            names=['Baits', 'Replicates'])
+        table = pd.DataFrame(block, index=self.info.index, columns=columns, copy=False)
+
+        info = self.info.copy()
+        info.columns = pd.MultiIndex.from_product([['Info'], list(info)],
+            names=['Baits', 'Replicates'])
+        table = pd.concat([info, table], axis=1)
+
+        if self.columns is not None and not table.columns.equals(self.columns):
+            table = table[self.columns]
+
+        return table
+
+    def flat(self):
+        """
+        Intensities as a (preys x samples) array in the column order of the
+        table, and the bait label of each column, as intensity_block returns
+        """
+        columns = self.column_positions()
+        return self.values[:, columns[0], columns[1]], self.baits[columns[0]]
+
+    def set_flat(self, values):
+        """
+        Tensor with the intensities of a (preys x samples) array in the layout
+        of flat
+        """
+        tensor = self.copy()
+        columns = self.column_positions()
+        tensor.values[:, columns[0], columns[1]] = values
+        return tensor
+
+    def column_positions(self):
+        """
+        (bait, slot) positions of the intensity columns in table order
+        """
+        bait_pos, slot_pos = np.nonzero(self.replicates != None)
+        if self.columns is None:
+            return bait_pos, slot_pos
+
+        # the labels of a bait's replicate slots, mapped to their table order
+        slots = {(self.baits[b], self.replicates[b, s]): (b, s)
+            for b, s in zip(bait_pos, slot_pos)}
+        order = [slots[col] for col in self.columns if col in slots]
+        return np.array([b for b, _ in order], dtype=int), np.array([s for _, s in order],
+            dtype=int)
+
+    def bait(self, bait):
+        """
+        (preys x replicates) intensities of a bait, without padding
+        """
+        b = self.bait_index(bait)
+        return self.values[:, b, :self.n_replicates[b]]
+
+    def bait_index(self, bait):
+        """
+        Position of a bait along the second axis
+        """
+        positions = np.flatnonzero(self.baits == bait)
+        if len(positions) == 0:
+            raise KeyError(bait)
+        return positions[0]
+
+    def medians(self, mean=False):
+        """
+        (preys x baits) median, or mean, of the replicates of each bait
+
+        rtype: np.array
+        """
+        # baits with no valid replicates of a prey give nans
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', category=RuntimeWarning)
+            if mean:
+                return np.nanmean(self.values, axis=2)
+            return np.nanmedian(self.values, axis=2)
+
+    def take(self, rows):
+        """
+        Tensor of a subset of preys, from positions or a boolean mask
+        """
+        return ReplicateTensor(self.values[rows], self.baits, self.replicates.copy(),
+            self.info.iloc[rows], self.columns)
+
+    def copy(self):
+        return ReplicateTensor(self.values.copy(), self.baits.copy(),
+            self.replicates.copy(), self.info.copy(), self.columns)
+
+    @property
+    def preys(self):
+        """
+        Protein IDs of the preys, or the row index if there are none
+        """
+        if 'Protein IDs' in self.info:
+            return self.info['Protein IDs'].to_numpy()
+        return self.info.index.to_numpy()
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    @property
+    def nbytes(self):
+        return self.values.nbytes
+
+
+def replicate_slots(col_baits):
+    """
+    Bait position and replicate slot of every column given its bait label
+
+    rtype: baits np.array, bait_pos np.array, slot_pos np.array
+    """
+    bait_pos, baits = pd.factorize(np.asarray(col_baits, dtype=object), sort=False)
+
+    # slot of a column is the number of earlier columns of the same bait
+    slot_pos = pd.Series(bait_pos).groupby(bait_pos).cumcount().to_numpy()
+
+    return np.asarray(baits, dtype=object), bait_pos, slot_pos
+
+
+def as_table(table):
+    """
+    DataFrame layout of a table or ReplicateTensor
+    """
+    if isinstance(table, ReplicateTensor):
+        return table.to_table()
+    return table
+
+
+def as_tensor(table, dtype=np.float32):
+    """
+    ReplicateTensor of a table or ReplicateTensor
+    """
+    if isinstance(table, ReplicateTensor):
+        return table
+    return ReplicateTensor.from_table(table, dtype=dtype)
@@ -0,0 +1,128 @@
+import numpy as np
+import pandas as pd
+from multiprocessing import shared_memory
+
+
+# Tables and arguments attached once per pool worker by init_worker
+worker_tables = {}
+worker_args = {}
+
+
+class SharedMatrix:
+    """
+    SharedMatrix holds the numeric intensity block of a (Baits, Replicates) table
+    in shared memory, along with its column labels and row index. Pool workers
+    attach to the block by name without copying it, so a task only needs to
+    send a bait name instead of the pickled table.
+    """
+
+    def __init__(self, shm, shape, dtype, columns, index, owner=False):
+
+        self.shm = shm
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        # list of (Baits, Replicates) tuples
+        self.columns = columns
+        # list of row labels, Protein IDs for imputed tables
+        self.index = index
+        # only the process that created the block unlinks it
+        self.owner = owner
+
+        self.values = np.ndarray(self.shape, dtype=self.dtype, buffer=shm.buf)
+
+    @classmethod
+    def from_table(cls, df, index=None, dtype=float):
+        """
+        Copy the non-Info columns of a (Baits, Replicates) table to a new
+        shared memory block.
+            index: list, row labels to use instead of the df index,
+                e.g. the Protein IDs of an imputed table
+        """
+        if 'Info' in df.columns.get_level_values(0):
+            df = df.drop('Info', level=0, axis=1)
+
+        values = df.to_numpy(dtype=dtype)
+        shm = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+        matrix = cls(shm, values.shape, values.dtype, list(df.columns),
+            list(df.index) if index is None else list(index), owner=True)
+        matrix.values[:] = values
+
+        return matrix
+
+    @classmethod
+    def attach(cls, descriptor):
+        """
+        Attach to an existing shared memory block from its descriptor
+        """
+        # pool workers share the resource tracker of the process that created
+        # the block, so attaching does not change when it is freed
+        shm = shared_memory.SharedMemory(name=descriptor['name'])
+        return cls(shm, descriptor['shape'], descriptor['dtype'], descriptor['columns'],
+            descriptor['index'])
+
+    def descriptor(self):
+        """
+        Lightweight, picklable description of the block used to attach to it
+        """
+        return {
+            'name': self.shm.name,
+            'shape': self.shape,
+            'dtype': self.dtype.str,
+            'columns': self.columns,
+            'index': self.index
+        }
+
+    def to_frame(self):
+        """
+        Zero-copy DataFrame view of the shared block, indexed by the row labels
+        """
+        columns = pd.MultiIndex.from_tuples(self.columns, names=['Baits', 'Replicates'])
+        return pd.DataFrame(self.values, index=self.index, columns=columns, copy=False)
+
+    def column_positions(self, bait):
+        """
+        Positions of the replicate columns of a bait
+        """
+        return [i for i, col in enumerate(self.columns) if col[0] == bait]
+
+    def close(self):
+        """
+        Detach from the shared block
+        """
+        self.values = None
+        self.shm.close()
+
+    def unlink(self):
+        """
+        Detach and, if this process created the block, free it
+        """
+        self.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def init_worker(descriptors, args=None):
+    """
+    Pool initializer that attaches the shared tables and static arguments
+    of a pool once per worker.
+        descriptors: dict, table name to SharedMatrix.descriptor()
+        args: dict, keyword arguments shared by all tasks
+    """
+    release_worker()
+
+    for name, descriptor in descriptors.items():
+        worker_tables[name] = SharedMatrix.attach(descriptor)
+
+    if args:
+        worker_args.update(args)
+
+
+def release_worker():
+    """
+    Detach the tables attached by init_worker, e.g. after a serial or thread
+    map attached them in the calling process
+    """
+    for matrix in worker_tables.values():
+        matrix.close()
+    worker_tables.clear()
+    worker_args.clear()
@@ -0,0 +1,335 @@
+import json
+import os
+import pickle
+import numpy as np
+import pandas as pd
+
+
+class StageStore:
+    """
+    StageStore keeps each intermediate table of a RawTables or AnalysisTables
+    analysis as its own set of columnar .npy files, described by a small JSON
+    manifest. Tables are read back one stage at a time, and their numeric
+    blocks are memory-mapped instead of being unpickled along with every
+    other stage.
+    """
+
+    def __init__(self, directory):
+
+        self.directory = directory
+        self.manifest_file = os.path.join(directory, 'manifest.json')
+
+        if os.path.isfile(self.manifest_file):
+            with open(self.manifest_file) as file_:
+                self.manifest = json.load(file_)
+        else:
+            self.manifest = {'class': None, 'stages': {}, 'attributes': {}}
+
+    def stages(self):
+        """
+        List of the tables available in the store
+        """
+        return list(self.manifest['stages'])
+
+    def save_table(self, name, df):
+        """
+        Save a DataFrame as a stage of the store. Consecutive columns of the same
+        numeric dtype are written as one 2D block, string columns as a fixed-width
+        unicode block with a missing-value mask, categoricals as their codes, and
+        any other column is pickled.
+        """
+        entry = {
+            'columns': [encode_label(col) for col in df.columns],
+            'column_names': [encode_label(col) for col in df.columns.names],
+            'index': self.save_index(name, df.index),
+            'runs': []
+        }
+
+        for i, (kind, start, stop) in enumerate(column_runs(df)):
+            prefix = name + '.' + str(i)
+            run = {'kind': kind, 'start': start, 'stop': stop}
+            block = df.iloc[:, start:stop]
+
+            if kind == 'numeric':
+                run['file'] = self.write_array(prefix + '.npy', block.to_numpy())
+
+            elif kind == 'category':
+                values = block.iloc[:, 0].cat
+                run['file'] = self.write_array(prefix + '.npy', values.codes.to_numpy())
+                run['categories'] = [encode_label(cat) for cat in values.categories]
+                run['ordered'] = bool(values.ordered)
+
+            elif kind == 'text':
+                missing = block.isna().to_numpy()
+                text = np.where(missing, '', block.to_numpy()).astype(str)
+                run['file'] = self.write_array(prefix + '.npy', text)
+                run['mask'] = self.write_array(prefix + '.mask.npy', missing)
+
+            else:
+                run['file'] = prefix + '.pkl'
+                with open(os.path.join(self.directory, run['file']), 'wb') as file_:
+                    pickle.dump(block, file_, -1)
+
+            entry['runs'].append(run)
+
+        self.manifest['stages'][name] = entry
+        self.write_manifest()
+
+    def load_table(self, name, mmap=True):
+        """
+        Load a single stage of the store. With mmap, numeric blocks are mapped
+        copy-on-write, so they are only paged in as they are used and in-place
+        changes never reach the files.
+        """
+        entry = self.manifest['stages'][name]
+        columns = [decode_label(col) for col in entry['columns']]
+        index = self.load_index(entry['index'], mmap)
+
+        frames = []
+        for run in entry['runs']:
+            run_cols = columns[run['start']:run['stop']]
+
+            if run['kind'] == 'numeric':
+                values = self.read_array(run['file'], mmap)
+                frame = pd.DataFrame(values, index=index, columns=range(len(run_cols)),
+                    copy=False)
+
+            elif run['kind'] == 'category':
+                codes = self.read_array(run['file'], mmap)
+                categories = [decode_label(cat) for cat in run['categories']]
+                values = pd.Categorical.from_codes(codes, categories=categories,
+                    ordered=run['ordered'])
+                frame = pd.DataFrame({0: values}, index=index)
+
+            elif run['kind'] == 'text':
+                text = self.read_array(run['file'], False).astype(object)
+                text[self.read_array(run['mask'], False)] = np.nan
+                frame = pd.DataFrame(text, index=index, columns=range(len(run_cols)))
+
+            else:
+                with open(os.path.join(self.directory, run['file']), 'rb') as file_:
+                    frame = pickle.load(file_)
+                frame.index = index
+
+            frame.columns = range(run['start'], run['stop'])
+            frames.append(frame)
+
+        if frames:
+            df = pd.concat(frames, axis=1, copy=False)
+        else:
+            df = pd.DataFrame(index=index)
+
+        if len(entry['column_names']) > 1:
+            df.columns = pd.MultiIndex.from_tuples(columns,
+                names=[decode_label(n) for n in entry['column_names']])
+        else:
+            df.columns = pd.Index(columns, name=decode_label(entry['column_names'][0]),
+                tupleize_cols=False)
+
+        return df
+
+    def save_index(self, name, index):
+        """
+        RangeIndexes are kept in the manifest, other indexes are saved as tables
+        """
+        if isinstance(index, pd.RangeIndex):
+            return {'kind': 'range', 'start': int(index.start), 'stop': int(index.stop),
+                'step': int(index.step), 'name': encode_label(index.name)}
+
+        self.save_table(name + '.index', index.to_frame(index=False))
+        return {'kind': 'table', 'table': name + '.index',
+            'names': [encode_label(n) for n in index.names]}
+
+    def load_index(self, entry, mmap):
+        """
+        Rebuild a saved index
+        """
+        if entry['kind'] == 'range':
+            return pd.RangeIndex(entry['start'], entry['stop'], entry['step'],
+                name=decode_label(entry['name']))
+
+        frame = self.load_table(entry['table'], mmap)
+        names = [decode_label(n) for n in entry['names']]
+        if len(names) > 1:
+            return pd.MultiIndex.from_arrays([frame[col].array for col in frame], names=names)
+        return pd.Index(frame.iloc[:, 0].array, name=names[0], tupleize_cols=False)
+
+    def write_array(self, file_name, array):
+        """
+        Write an array through a temporary file, so that memory maps of a
+        previous version of the file stay valid
+        """
+        path = os.path.join(self.directory, file_name)
+        with open(path + '.tmp', 'wb') as file_:
+            np.save(file_, np.ascontiguousarray(array), allow_pickle=False)
+        os.replace(path + '.tmp', path)
+        return file_name
+
+    def read_array(self, file_name, mmap):
+        """
+        Read an array, memory-mapped copy-on-write if mmap
+        """
+        path = os.path.join(self.directory, file_name)
+        return np.load(path, mmap_mode='c' if mmap else None, allow_pickle=False)
+
+    def write_manifest(self):
+        """
+        Save the manifest of the store
+        """
+        with open(self.manifest_file + '.tmp', 'w') as file_:
+            json.dump(self.manifest, file_)
+        os.replace(self.manifest_file + '.tmp', self.manifest_file)
+
+
+def save_object(obj, directory):
+    """
+    Save every DataFrame attribute of a RawTables or AnalysisTables object as a
+    stage of a StageStore in directory. JSON-compatible attributes go to the
+    manifest and any remaining attributes are pickled together.
+
+    rtype: StageStore
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    store = StageStore(directory)
+    store.manifest = {'class': type(obj).__name__, 'stages': {}, 'attributes': {}}
+
+    # tables that were not loaded from a previous store are still to be copied
+    source = obj.__dict__.get('stage_store')
+    names = set(vars(obj))
+    if source is not None:
+        names.update(source.stages())
+
+    others = {}
+    for name in sorted(names):
+        if name == 'stage_store' or name.endswith('.index'):
+            continue
+        value = getattr(obj, name)
+        if isinstance(value, pd.DataFrame):
+            store.save_table(name, value)
+        elif is_json(value):
+            store.manifest['attributes'][name] = value
+        else:
+            others[name] = value
+
+    if others:
+        with open(os.path.join(directory, 'attributes.pkl'), 'wb') as file_:
+            pickle.dump(others, file_, -1)
+
+    store.write_manifest()
+    return store
+
+
+def load_object(cls, directory):
+    """
+    Create an object of cls from a StageStore directory without loading any
+    of its tables. Tables are loaded by lazy_stage on first access.
+    """
+    store = StageStore(directory)
+    obj = cls.__new__(cls)
+    obj.__dict__.update(store.manifest['attributes'])
+
+    others = os.path.join(directory, 'attributes.pkl')
+    if os.path.isfile(others):
+        with open(others, 'rb') as file_:
+            obj.__dict__.update(pickle.load(file_))
+
+    obj.stage_store = store
+    return obj
+
+
+def lazy_stage(obj, name):
+    """
+    __getattr__ helper that loads a missing table attribute from the object's
+    StageStore, raising AttributeError as usual if there is no such stage
+    """
+    store = obj.__dict__.get('stage_store')
+    if store is None or name.startswith('__') or name not in store.manifest['stages']:
+        raise AttributeError(name)
+
+    table = store.load_table(name)
+    setattr(obj, name, table)
+    return table
+
+
+def pickle_state(obj):
+    """
+    __getstate__ helper: the attributes of an object opened from a StageStore,
+    with every stage not yet accessed loaded in memory and the store itself
+    left out, so that the pickle does not depend on the store's directory
+    """
+    state = dict(obj.__dict__)
+    store = state.pop('stage_store', None)
+    if store is not None:
+        for name in store.stages():
+            if name not in state and not name.endswith('.index'):
+                state[name] = store.load_table(name, mmap=False)
+
+    return state
+
+
+def column_runs(df):
+    """
+    Split the columns of a DataFrame into runs of consecutive columns that share
+    a storage kind (and dtype, for numeric columns)
+
+    rtype: list of (kind, start, stop) tuples
+    """
+    runs = []
+    previous = None
+    for i, dtype in enumerate(df.dtypes):
+        if isinstance(dtype, pd.CategoricalDtype):
+            key = ('category', i)
+        elif dtype.kind in 'biuf':
+            key = ('numeric', dtype.str)
+        elif dtype.kind == 'O' and is_text(df.iloc[:, i]):
+            key = ('text', None)
+        else:
+            key = ('pickle', i)
+
+        if key == previous:
+            runs[-1][2] = i + 1
+        else:
+            runs.append([key[0], i, i + 1])
+        previous = key
+
+    return [tuple(run) for run in runs]
+
+
+def is_text(series):
+    """
+    Whether an object column only holds strings and missing values
+    """
+    values = series.dropna()
+    return all(isinstance(value, str) for value in values)
+
+
+def is_json(value):
+    """
+    Whether an attribute can be kept as is in the JSON manifest
+    """
+    try:
+        return json.loads(json.dumps(value)) == value
+    except (TypeError, ValueError):
+        return False
+
+
+def encode_label(label):
+    """
+    JSON representation of a column label, keeping tuples apart from lists
+    """
+    if isinstance(label, tuple):
+        return {'tuple': [encode_label(item) for item in label]}
+    if isinstance(label, np.generic):
+        return label.item()
+    return label
+
+
+def decode_label(label):
+    """
+    Inverse of encode_label
+    """
+    if isinstance(label, dict):
+        return tuple(decode_label(item) for item in label['tuple'])
+    return label
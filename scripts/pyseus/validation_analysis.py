@@ -17,8 +17,6 @@ from multiprocessing import Queue
 from sklearn.preprocessing import StandardScaler
 from sklearn.decomposition import PCA
 from sklearn.cluster import KMeans
-from itertools import repeat
-from multiprocessing import Pool
 from scipy.spatial.distance import pdist
 from scipy.spatial.distance import squareform
 from scipy.stats import percentileofscore
@@ -54,14 +52,10 @@ class Validation():
         """
 
         hits = self.hit_table.copy()
-        hits['fdr'] = None
-        hits['fdr'] = hits['fdr'].apply(lambda x: [curvature, offset])
+        hits['fdr'] = [[curvature, offset] for _ in range(hits.shape[0])]
 
-        bait_pval = hits['pvals']
-        enrichment = hits['enrichment']
-
-        threshold = enrichment.apply(pa.calc_thresh, args=[curvature, offset])
-        hits['interaction'] = np.where((bait_pval > threshold), True, False)
+        hits['interaction'] = pa.fdr_hits(hits['enrichment'], hits['pvals'],
+            [curvature, offset])
 
         self.interaction_table = hits[hits['interaction']]
 
@@ -90,23 +84,16 @@ class Validation():
         """
         hits = self.hit_table.copy()
         
-        # group hits table by experiment & target and place them into a bin of lists
-        selects = []
-        grouped = hits.groupby(['experiment', 'target'])
+        # group hits table by experiment & target, and find the FDR seed of each group.
+        # dfdr_find_thresh is a sorted-array search, so no process pool is needed
+        grouped = hits.groupby(['experiment', 'target'], observed=True)
         baits = []
         experiments = []
+        seeds = []
         for bait, group in grouped:
             experiments.append(bait[0])
             baits.append(bait[1])
-            selects.append(group)
-        
-        # parallel processing for calculating FDR seed
-
-        p = Pool()
-        seeds = p.starmap(dfdr_find_thresh, zip(selects, baits,
-            repeat(perc), repeat(curvature), repeat(offset_seed)))
-        p.close()
-        p.join()
+            seeds.append(dfdr_find_thresh(group, bait[1], perc, curvature, offset_seed))
 
         fdr_full = [[curvature, seed] for seed in seeds]
         
@@ -116,29 +103,19 @@ class Validation():
         fdr_df['fdr'] = fdr_full
         # fdr_df.set_index('bait', inplace=True)    
         
-        ############ Have to reconcile proper hits table format #######
-        new_groups = []
-        for bait, group in grouped:
-            group = group.copy()
-            experiment = bait[0]
-            target = bait[1]
-            fdr = fdr_df[(fdr_df['experiment']==experiment) &
-                (fdr_df['target']==target)].fdr.item()           
-
-            
-            bait_pval = group['pvals']
-            enrichment = group['enrichment']
-
-            thresh = enrichment.apply(pa.calc_thresh,
-                args=[fdr[0], fdr[1]])
+        # threshold every row with the seed of its group in one pass, keeping
+        # the rows in group order
+        group_ids = grouped.ngroup().to_numpy()
+        order = np.argsort(group_ids, kind='stable')
+        order = order[group_ids[order] >= 0]
+        interaction_table = hits.iloc[order].copy()
+        group_ids = group_ids[order]
+
+        thresh = pa.calc_thresh(interaction_table['enrichment'], curvature,
+            np.array(seeds, dtype=float)[group_ids])
+        interaction_table['interaction'] = interaction_table['pvals'].to_numpy() > thresh
+        interaction_table['fdr'] = [fdr_full[i] for i in group_ids]
 
-            group['interaction'] = np.where(
-                (bait_pval > thresh), True, False)
-
-            group['fdr'] = [fdr] * group.shape[0]
-            new_groups.append(group)
-
-        interaction_table = pd.concat(new_groups)
         self.dynamic_fdr_table = fdr_df
         self.interaction_table = interaction_table[interaction_table['interaction']]
 
@@ -155,41 +132,26 @@ class Validation():
             dataset = dataset[dataset[target_col] != dataset[prey_col]]
         original = self.interaction_table.copy()
 
-        # combine values from two columns to a list and sort alphabetically
-        dataset = dataset[[target_col, prey_col]]
-        
-        # force values in target and prey columns to be string
-        dataset[target_col] = dataset[target_col].astype(str)
-        dataset[prey_col] = dataset[prey_col].astype(str)
-
-        combined = pd.Series(dataset.values.tolist())
-
-        combined = combined.apply(sorted)
-
-        combined_list = combined.to_list()
-
-        # Unzip the sorted interactions and create them into two lists
-        unzipped = list(zip(*combined_list))
+        # sort the two proteins of each interaction alphabetically and drop duplicates
+        interactions = sorted_pairs(dataset[target_col], dataset[prey_col])
+        interactions.drop_duplicates(inplace=True)
 
-        first, second = unzipped[0], unzipped[1]
+        if get_edge:
+            # max edge of each unique pair over both directions of the interaction,
+            # and the self-interactions of either protein
+            original = original[original[target_col].notna() & original[prey_col].notna()]
+            pairs = sorted_pairs(original[target_col], original[prey_col])
+            pairs[edge] = original[edge].to_numpy()
 
-        # Generate a sorted interaction dataframe and drop duplicates
-        interactions = pd.DataFrame()
-        interactions['prot_1'] = first
-        interactions['prot_2'] = second
+            pair_max = pairs.groupby(['prot_1', 'prot_2'], observed=True)[edge].max()
+            pair_max = pair_max.reindex(pd.MultiIndex.from_frame(interactions))
 
-        interactions.drop_duplicates(inplace=True)
+            selfs = pairs[pairs['prot_1'] == pairs['prot_2']]
+            self_max = selfs.groupby('prot_1', observed=True)[edge].max()
 
-        if get_edge:
-            vals = []
-            for i, row in interactions.iterrows():
-                prot_1 = row.prot_1
-                prot_2 = row.prot_2
-                prots = [prot_1, prot_2]
-                selection = original[
-                    (original[target_col].isin(prots)) & original[prey_col].isin(prots)]
-                max_edge = selection[edge].max()
-                vals.append(max_edge)
+            vals = np.fmax(pair_max.to_numpy(dtype=float),
+                self_max.reindex(interactions['prot_1']).to_numpy(dtype=float))
+            vals = np.fmax(vals, self_max.reindex(interactions['prot_2']).to_numpy(dtype=float))
             interactions[edge] = vals
         interactions.reset_index(drop=True, inplace=True)
 
@@ -208,62 +170,44 @@ class Validation():
         target_col = self.target
         prey_col = self.prey
         network = self.interaction_table[[target_col, prey_col]]
-        corum = self.corum.copy()
+        corum = self.corum
         
         # get a list of all unique targets in the ppi network
         targets = set(network[target_col].to_list())
 
-        # count all the corum interactions possible within targets if directional is False
+        prot_1 = corum['prot_1']
+        prot_2 = corum['prot_2']
+
+        # count all the corum interactions possible within targets
         if directional:
-            overlap_sum = 0
+            overlap_sum = prot_1.isin(targets).sum() + prot_2.isin(targets).sum()
         else:
-            overlap_corum = corum[(corum['prot_1'].isin(targets)) | (corum['prot_2'].isin(targets))]
-            overlap_sum = overlap_corum.shape[0]
-
-        coverage_sum = 0
-        for target in targets:
-            # get all the corum interactions possible with the targets
-            left_corum = corum[corum['prot_1'] == target]
-            right_corum = corum[corum['prot_2'] == target]
-
-            # if directional, add all the possible CORUM interaction counts
-            if directional:
-                overlap_sum += left_corum.shape[0] + right_corum.shape[0]
-
-            network_target = network[network[target_col] == target]
-            network_preys = set(network_target[prey_col].to_list())
-
-            left_covered = left_corum[left_corum['prot_2'].isin(network_preys)]
-            right_covered = right_corum[right_corum['prot_1'].isin(network_preys)]
-
-            # the distance option searches for second neighbors of a target, for the preys
-            # of the target that were corum interactors.
-            if distance:
-                left_preys = left_covered['prot_2'].to_list()
-                right_preys = right_covered['prot_1'].to_list()
+            overlap_sum = (prot_1.isin(targets) | prot_2.isin(targets)).sum()
 
-                left_targets = targets.intersection(left_preys)
-                right_targets = targets.intersection(right_preys)
+        if distance:
+            coverage_sum = second_neighbor_coverage(network, target_col, prey_col,
+                prot_1, prot_2, targets, directional)
 
-                new_targets = left_targets.union(right_targets)
-                new_targets.add(target)
-
-                expanded_target = network[network[target_col].isin(new_targets)]
-                expanded_preys = set(expanded_target[prey_col].to_list())
-
-                left_covered = left_corum[left_corum['prot_2'].isin(expanded_preys)]
-                right_covered = right_corum[right_corum['prot_1'].isin(expanded_preys)]
-
-
-            # calculate how many corum interactions were covered by the target in network
-            coverage_sum += left_covered.shape[0] + right_covered.shape[0]
+        else:
+            # corum interactions found in the network as target-prey, or as prey-target,
+            # as integer pair keys in the gene dictionary of the network
+            genes, (target_codes, prey_codes) = shared_gene_codes(network[target_col],
+                network[prey_col])
+            edges = pair_keys(target_codes, prey_codes, len(genes))
+            edges = edges[edges >= 0]
+
+            corum_1 = genes.get_indexer(prot_1)
+            corum_2 = genes.get_indexer(prot_2)
+            forward = np.isin(pair_keys(corum_1, corum_2, len(genes)), edges)
+            reverse = np.isin(pair_keys(corum_2, corum_1, len(genes)), edges)
 
-            if not directional:
-                # delete covered interactions
-                left_idxs = left_covered.index.to_list()
-                right_idxs = right_covered.index.to_list()
-                drop_idxs = left_idxs + right_idxs
-                corum.drop(drop_idxs, inplace=True)
+            if directional:
+                coverage_sum = forward.sum() + reverse.sum()
+            else:
+                # an interaction is only covered once, except for self-interactions
+                # which are covered from both of their sides at once
+                self_covered = forward & (prot_1 == prot_2).to_numpy()
+                coverage_sum = (forward | reverse).sum() + self_covered.sum()
 
         self.recall = coverage_sum / overlap_sum
 
@@ -284,16 +228,25 @@ class Validation():
         target_col = 'prot_1'
         prey_col = 'prot_2'
 
-        network = network[[target_col, prey_col]].copy()
-        # force string type
-        network[target_col] = network[target_col].astype(str)
-        network[prey_col] = network[prey_col].astype(str)
+        # genes as integer codes of one gene dictionary, forcing string type
+        genes, (target_codes, prey_codes) = shared_gene_codes(network[target_col],
+            network[prey_col])
+        network = pd.DataFrame({target_col: target_codes, prey_col: prey_codes})
 
         network = network[network[target_col] != network[prey_col]]
-        localization = self.localization_table.copy()
 
-        localization['mnc_classifier'] = localization['mnc_classifier'].apply(
-            lambda x: x.split('/'))
+        # localization classes of each gene as integer bitmasks, encoded once per table
+        encoded = getattr(self, 'encoded_localization', None)
+        if encoded is None or encoded[0] is not self.localization_table:
+            encoded = (self.localization_table,) + localization_bitmasks(
+                self.localization_table)
+            self.encoded_localization = encoded
+        _, localization, wildcard = encoded
+
+        localization = pd.DataFrame({
+            'gene_names': genes.get_indexer(localization['gene_names']),
+            'mnc_classifier': localization['mnc_classifier'].to_numpy()})
+        localization = localization[localization['gene_names'] >= 0]
 
         # make target and prey merges with localization data
         # inner merge network data with localization on targets
@@ -306,78 +259,263 @@ class Validation():
             on=prey_col, how='inner')
 
         # find interactions where there is at least one mutual localization between
-        # target and prey. Save the indices of the colocalized interactions
-        intersections = []
-        for i, row in merge2.iterrows():
-            target = set(row.target_localization)
-            prey = set(row.prey_localization)
-            if len(target.intersection(prey)) > 0:
-                intersections.append(i)
-            elif 'B' in target or 'B' in prey:
-                intersections.append(i)
-
-        self.precision =  merge2.loc[intersections].shape[0] / merge2.shape[0]
+        # target and prey, or where either is localized to the 'B' wildcard
+        target = merge2['target_localization'].to_numpy()
+        prey = merge2['prey_localization'].to_numpy()
+        colocalized = ((target & prey) != 0) | (((target | prey) & wildcard) != 0)
+
+        self.precision = colocalized.sum() / merge2.shape[0]
+
+def localization_bitmasks(localization):
+    """
+    Encode the '/'-separated mnc_classifier classes of a localization table
+    as one integer bitmask per row, uint64 if there are at most 64 classes
+    and python ints otherwise
+
+    rtype: DataFrame of gene_names and mnc_classifier masks, wildcard 'B' mask
+    """
+    classes = localization['mnc_classifier'].reset_index(drop=True).str.split('/')
+    classes = classes.explode().dropna()
+    classes = pd.DataFrame({'row': classes.index, 'class': classes.to_numpy()})
+    classes.drop_duplicates(inplace=True)
+
+    codes, uniques = pd.factorize(classes['class'])
+    if len(uniques) <= 64:
+        one = np.uint64(1)
+        bits = np.left_shift(one, codes.astype(np.uint64))
+        masks = np.zeros(localization.shape[0], dtype=np.uint64)
+    else:
+        one = 1
+        bits = np.array([1 << int(code) for code in codes], dtype=object)
+        masks = np.array([0] * localization.shape[0], dtype=object)
+
+    # the classes of a row are unique, so the sum of their bits is their bitwise or
+    sums = pd.Series(bits, index=classes['row'].to_numpy()).groupby(level=0).sum()
+    masks[sums.index.to_numpy()] = sums.to_numpy()
+
+    wildcard = one - one
+    if 'B' in uniques:
+        wildcard = one << type(one)(uniques.get_loc('B'))
+
+    encoded = pd.DataFrame({
+        'gene_names': localization['gene_names'].to_numpy(),
+        'mnc_classifier': masks})
+
+    return encoded, wildcard
+
+
+def second_neighbor_coverage(network, target_col, prey_col, prot_1, prot_2, targets,
+    directional):
+    """
+    CORUM interactions covered by each target's preys, or by the preys of
+    the targets among them that are its CORUM interactors. Unless directional,
+    covered interactions are removed as targets are visited, so targets are
+    visited in the iteration order of the targets set.
+    """
+    preys = {target: set(group) for target, group
+        in network.groupby(target_col, observed=True)[prey_col]}
+
+    # positions of the corum interactions on either side of each protein
+    first = prot_1.to_numpy(dtype=object)
+    second = prot_2.to_numpy(dtype=object)
+    left_rows = collections.defaultdict(list)
+    right_rows = collections.defaultdict(list)
+    for i, (left, right) in enumerate(zip(first, second)):
+        left_rows[left].append(i)
+        right_rows[right].append(i)
+    removed = np.zeros(len(first), dtype=bool)
+
+    coverage_sum = 0
+    for target in targets:
+        left_corum = [i for i in left_rows.get(target, []) if not removed[i]]
+        right_corum = [i for i in right_rows.get(target, []) if not removed[i]]
+
+        network_preys = preys.get(target, set())
+        left_covered = [i for i in left_corum if second[i] in network_preys]
+        right_covered = [i for i in right_corum if first[i] in network_preys]
+
+        new_targets = targets.intersection([second[i] for i in left_covered])
+        new_targets.update(targets.intersection([first[i] for i in right_covered]))
+        new_targets.add(target)
+
+        expanded_preys = set()
+        for new_target in new_targets:
+            expanded_preys.update(preys.get(new_target, ()))
+
+        left_covered = [i for i in left_corum if second[i] in expanded_preys]
+        right_covered = [i for i in right_corum if first[i] in expanded_preys]
+
+        coverage_sum += len(left_covered) + len(right_covered)
+
+        if not directional:
+            removed[left_covered] = True
+            removed[right_covered] = True
+
+    return coverage_sum
+
+
+def sorted_pairs(targets, preys):
+    """
+    Directionless protein pairs of target and prey columns, sorted alphabetically
+    within each pair. Categorical columns sharing a sorted gene dictionary are
+    sorted by their codes and stay categorical, other columns are forced to strings.
+
+    rtype: DataFrame with prot_1 and prot_2 columns
+    """
+    genes = shared_categories(targets, preys)
+    if genes is not None:
+        target_codes = targets.cat.codes.to_numpy()
+        prey_codes = preys.cat.codes.to_numpy()
+        if (target_codes >= 0).all() and (prey_codes >= 0).all():
+            swap = prey_codes < target_codes
+            return pd.DataFrame({
+                'prot_1': pd.Categorical.from_codes(np.where(swap, prey_codes, target_codes),
+                    categories=genes),
+                'prot_2': pd.Categorical.from_codes(np.where(swap, target_codes, prey_codes),
+                    categories=genes)})
+
+    targets = targets.astype(str).to_numpy(dtype=object)
+    preys = preys.astype(str).to_numpy(dtype=object)
+    swap = preys < targets
+
+    return pd.DataFrame({
+        'prot_1': np.where(swap, preys, targets),
+        'prot_2': np.where(swap, targets, preys)})
+
+
+def shared_categories(*columns):
+    """
+    The gene dictionary of categorical columns that share the same sorted
+    string categories, as in the standard hits table, None otherwise
+
+    rtype: pd.Index or None
+    """
+    if not all(isinstance(col.dtype, pd.CategoricalDtype) for col in columns):
+        return None
+
+    genes = columns[0].cat.categories
+    if not all(col.cat.categories.equals(genes) for col in columns[1:]):
+        return None
+    if genes.inferred_type != 'string' or not genes.is_monotonic_increasing:
+        return None
+
+    return genes
+
+
+def shared_gene_codes(*columns):
+    """
+    Integer codes of gene name columns in one sorted gene dictionary, so that
+    comparisons, joins and isin filters are integer operations. Columns without a
+    shared dictionary are forced to strings and given one.
+
+    rtype: genes pd.Index, list of np.array codes, -1 for missing values
+    """
+    genes = shared_categories(*columns)
+    if genes is not None:
+        return genes, [col.cat.codes.to_numpy() for col in columns]
+
+    columns = [pd.Series(col).astype(str) for col in columns]
+    genes = pd.Index(pd.unique(np.concatenate([col.to_numpy(dtype=object)
+        for col in columns]))).sort_values()
+
+    return genes, [genes.get_indexer(col) for col in columns]
+
+
+def pair_keys(first, second, n_genes):
+    """
+    Single integer key of each (first, second) pair of gene codes, -1 if
+    either gene is missing from the dictionary
+    """
+    first = np.asarray(first, dtype=np.int64)
+    second = np.asarray(second, dtype=np.int64)
+    return np.where((first >= 0) & (second >= 0), first * n_genes + second, -1)
+
 
 def dfdr_find_thresh(select, bait, perc=10, curvature=3, seed=2.5):
     """
-    Find the proper p-val/enrichment threshold for a bait
+    Find the proper p-val/enrichment threshold for a bait. The offset seed is
+    stepped as before, but hits at every step are counted by a sorted-array
+    search on the critical offsets of the negative and positive preys.
     """
     
     # filter for negative hits
-    neg_select = select[select['enrichment'] < 0]
-    pos_select = select[select['enrichment'] > 0]
+    neg_crit = critical_offsets(select[select['enrichment'] < 0], curvature)
+    pos_crit = critical_offsets(select[select['enrichment'] > 0], curvature)
 
     # calcuate initial hit count by given curvature and seed
-    hit = hit_count(neg_select, curvature, seed)
+    hit = count_above(neg_crit, seed)
     
     # Find a threshold that lies just outside one hit detection
-    if hit > 0:
-        while hit > 0 and seed < 10:
-            if seed > 4.2:
-                seed += 0.2
-            else:
-                seed += 0.1
-            hit = hit_count(neg_select, 3, seed)
-    else:
-        while hit == 0:
-            seed -= 0.1
-            hit = hit_count(neg_select, 3, seed)
-        seed += 0.1
+    if hit > 0 and seed < 10:
+        steps = [seed]
+        while steps[-1] < 10:
+            steps.append(steps[-1] + (0.2 if steps[-1] > 4.2 else 0.1))
+        steps = np.array(steps[1:])
+        # stop at the first step without hits, or at 10
+        no_hits = np.flatnonzero(count_above(neg_crit, steps) == 0)
+        seed = steps[no_hits[0]] if len(no_hits) > 0 else steps[-1]
+
+    elif len(neg_crit) > 0:
+        # step down until the first negative hit, then back up once
+        steps = [seed - 0.1]
+        while steps[-1] >= neg_crit[-1]:
+            steps.append(steps[-1] - 0.1)
+        seed = steps[-1] + 0.1
     
     # With the calculated seed, find the threshold that meets the 
     # requirement of less than 2 neg hits or less than designated % of positive hits
-    neg_hit = hit_count(neg_select, 3, seed)
-    pos_hit = hit_count(pos_select, 3, seed)
-
-    pos_perc = 100 * neg_hit / pos_hit
-
-    while (neg_hit < 2 or pos_perc < perc) and seed > 0.1:
-
-        seed -= 0.1
-        neg_hit = hit_count(neg_select, 3, seed)
-        pos_hit = hit_count(pos_select, 3, seed)
+    steps = [seed]
+    while steps[-1] > 0.1:
+        steps.append(steps[-1] - 0.1)
+    steps = np.array(steps)
+
+    neg_hit = count_above(neg_crit, steps)
+    pos_hit = count_above(pos_crit, steps)
+    with np.errstate(divide='ignore', invalid='ignore'):
         pos_perc = 100 * neg_hit / pos_hit
 
-    if pos_perc > perc:
+    # the first step that no longer needs to lower the seed
+    keep = ~(((neg_hit < 2) | (pos_perc < perc)) & (steps > 0.1))
+    i = np.flatnonzero(keep)[0]
+    seed = steps[i]
+
+    if pos_perc[i] > perc:
         seed += 0.1
 
     return round(seed, 2)    
 
 
+def critical_offsets(bait_series, curvature):
+    """
+    Sorted offsets below which each prey of a bait series becomes a two-sided
+    FCD hit, |enrichment| - curvature / pvals. Preys that can never be hits are left out.
+    """
+    enrichment = np.abs(bait_series['enrichment'].to_numpy(dtype=float))
+    pvals = bait_series['pvals'].to_numpy(dtype=float)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        crit = enrichment - curvature / pvals
+    crit = crit[(pvals > 0) & ~np.isnan(crit)]
+
+    return np.sort(crit)
+
+
+def count_above(crit, offset):
+    """
+    Count # of critical offsets above an offset, or each of an array of offsets
+    """
+    return len(crit) - np.searchsorted(crit, offset, side='right')
+
 
 def hit_count(bait_series, curvature, offset):
     """
     Count # of hits possible in a bait series with a given curvature and offset
     """
-    bait_series = bait_series.copy()
-    thresh = bait_series['enrichment'].apply(calc_thresh, args=[curvature, offset])
-    hit = np.where(bait_series['pvals'] > thresh, True, False)
+    hit = pa.fdr_hits(bait_series['enrichment'], bait_series['pvals'],
+        [curvature, offset], two_sided=True)
 
     return hit.sum()
 
 def calc_thresh(enrich, curvature, offset):
-    """simple function to get FCD thresh to recognize hits"""
-    if abs(enrich) < offset:
-        return np.inf
-    else:
-        return curvature / (abs(enrich) - offset)
+    """simple function to get FCD thresh to recognize hits, two-sided"""
+    return pa.calc_thresh(enrich, curvature, offset, two_sided=True)
@@ -0,0 +1,24 @@
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pyseus import basic_processing as pys
+
+
+def test_transform_values_zeros_become_nans_for_non_log_transforms():
+    for func in [np.arcsinh, np.sqrt, lambda x: x + 1]:
+        values = np.array([[0., 4., 1000.]], dtype=np.float32)
+        transformed = pys.transform_values(values, func)
+
+        assert np.isnan(transformed[0, 0])
+        np.testing.assert_allclose(transformed[0, 1:], func(np.array([4., 1000.])),
+            rtol=1e-6)
+
+
+def test_transform_values_log2_zeros_become_nans():
+    values = np.array([[0., 4.]], dtype=np.float32)
+    transformed = pys.transform_values(values, np.log2)
+
+    assert np.isnan(transformed[0, 0])
+    assert transformed[0, 1] == 2
@@ -0,0 +1,31 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pyseus import interaction_store
+
+
+def test_queries_leave_out_missing_genes():
+    table = pd.DataFrame({
+        'target': ['A', 'A', 'A', 'C', np.nan],
+        'prey': ['B', np.nan, 'C', 'Z', 'B']})
+    store = interaction_store.InteractionStore.from_table(table)
+
+    assert store.preys_of('A') == ['B', 'C']
+    assert store.targets_of('B') == ['A']
+    assert store.targets_of('Z') == ['C']
+
+    within = store.edges_within(['A', 'B', 'C'])
+    assert within.index.tolist() == [0, 2]
+
+
+def test_categorical_queries_leave_out_missing_genes():
+    genes = ['A', 'B', 'C', 'Z']
+    table = pd.DataFrame({
+        'target': pd.Categorical(['A', 'A', 'A'], categories=genes),
+        'prey': pd.Categorical(['B', np.nan, 'C'], categories=genes)})
+    store = interaction_store.InteractionStore.from_table(table)
+
+    assert store.preys_of('A') == ['B', 'C']
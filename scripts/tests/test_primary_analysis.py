@@ -0,0 +1,50 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pyseus import primary_analysis as pa
+
+
+def missing_value_table(n_preys=60, n_baits=6, n_replicates=3, seed=0):
+    """
+    Imputed-style table that still has missing values, with a few preys left
+    with a single valid replicate in a bait
+    """
+    rng = np.random.default_rng(seed)
+    baits = ['BAIT' + str(i) for i in range(n_baits)]
+    columns = pd.MultiIndex.from_tuples(
+        [(bait, bait + '_' + str(rep)) for bait in baits for rep in range(n_replicates)],
+        names=['Baits', 'Replicates'])
+
+    values = rng.normal(20, 2, (n_preys, len(columns)))
+    values[rng.random(values.shape) < 0.25] = np.nan
+    # one valid replicate of the first bait for the first preys
+    values[:10, 1:n_replicates] = np.nan
+    values[:10, 0] = rng.normal(20, 2, 10)
+
+    df = pd.DataFrame(values, columns=columns)
+    df[('Info', 'Protein IDs')] = ['P' + str(i) for i in range(n_preys)]
+
+    exclusion = pd.DataFrame({bait: [True] * n_baits for bait in baits})
+    exclusion[baits[1]] = [other != baits[2] for other in baits]
+    exclusion.insert(0, 'Baits', baits)
+
+    return df, exclusion, baits
+
+
+def test_vectorized_pvals_match_per_row_ttest_with_missing_values():
+    df, exclusion, baits = missing_value_table()
+
+    vectorized = pa.vectorized_pval_enrichment(baits, df, exclusion)
+    per_row = pd.concat([pa.calculate_pval(bait, df, exclusion) for bait in baits], axis=1)
+
+    for bait in baits:
+        for value in ['pvals', 'enrichment']:
+            expected = per_row[(bait, value)].to_numpy(dtype=float)
+            result = vectorized[(bait, value)].to_numpy(dtype=float)
+            np.testing.assert_allclose(result, expected, rtol=1e-9, atol=1e-12)
+
+    # preys with a single valid bait replicate still get a finite pval
+    assert np.isfinite(vectorized[(baits[0], 'pvals')].to_numpy(dtype=float)[:10]).all()
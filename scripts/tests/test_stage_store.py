@@ -0,0 +1,44 @@
+import os
+import shutil
+import sys
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pyseus import basic_processing as pys
+from pyseus import primary_analysis as pa
+from pyseus import benchmark
+
+
+def test_pickle_of_columnar_load_does_not_need_the_directory(tmp_path):
+    root = str(tmp_path) + '/'
+    os.makedirs(root + 'analysis')
+    benchmark.synthetic_protein_groups(n_baits=4, n_preys=200).to_csv(
+        root + 'proteinGroups.txt', sep='\t', index=False)
+
+    raw = pys.RawTables(root, 'analysis', 'LFQ intensity')
+    raw.filter_table(verbose=False)
+    raw.transform_intensities()
+    raw.save(columnar=True)
+
+    analysis = pa.AnalysisTables(root, 'analysis', raw.transformed_table, None)
+    analysis.simple_pval_table = raw.filtered_table.head()
+    analysis.save('analysis', columnar=True)
+
+    # open the columnar saves, touch one table, and pickle them
+    raw_columnar = pys.load_raw_tables(root + 'analysis/preprocessed_tables')
+    raw_columnar.filtered_table
+    raw_columnar.save('pickled')
+    analysis_columnar = pa.load_analysis_tables(root + 'analysis/pval_tables_analysis')
+    analysis_columnar.save('pickled')
+
+    shutil.rmtree(root + 'analysis/preprocessed_tables')
+    shutil.rmtree(root + 'analysis/pval_tables_analysis')
+
+    loaded = pys.load_raw_tables(root + 'analysis/preprocessed_tables_pickled.pkl')
+    assert 'stage_store' not in vars(loaded)
+    for name in ['raw_table', 'filtered_table', 'transformed_table']:
+        pd.testing.assert_frame_equal(getattr(loaded, name), getattr(raw, name))
+
+    loaded = pa.load_analysis_tables(root + 'analysis/pval_tables_pickled.pkl')
+    pd.testing.assert_frame_equal(loaded.imputed_table, analysis.imputed_table)
+    pd.testing.assert_frame_equal(loaded.simple_pval_table, analysis.simple_pval_table)